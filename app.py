@@ -1,9 +1,15 @@
+import importlib
 import streamlit as st
-from modules.text_to_image import show_text_to_image_tab
-from modules.image_to_image import show_image_to_image_tab
-from modules.upscaler import show_upscaler_tab
-from modules.controlnet import show_controlnet_tab
 from modules.server_config import setup_sidebar
+from modules.widget_state import keep_widget_state
+
+# Tab name -> (module, function). Tab modules are imported on first use only.
+TABS = {
+    "Text to Image": ("modules.text_to_image", "show_text_to_image_tab"),
+    "Image to Image": ("modules.image_to_image", "show_image_to_image_tab"),
+    "Upscaler": ("modules.upscaler", "show_upscaler_tab"),
+    "ControlNet": ("modules.controlnet", "show_controlnet_tab"),
+}
 
 st.set_page_config(page_title="Stable Diffusion Frontend", layout="wide")
 
@@ -13,20 +19,14 @@ st.title("Stable Diffusion API Frontend")
 # Setup sidebar for server configuration and model selection
 setup_sidebar()
 
-# Main content area with tabs
-tab1, tab2, tab3, tab4 = st.tabs(["Text to Image", "Image to Image", "Upscaler", "ControlNet"])
-
-with tab1:
-    show_text_to_image_tab()
-
-with tab2:
-    show_image_to_image_tab()
-
-with tab3:
-    show_upscaler_tab()
+# Main content area - only the selected tab is rendered on each rerun, so the
+# widget values of the other tabs are kept in session state
+keep_widget_state()
+selected_tab = st.radio("Tab", list(TABS.keys()), horizontal=True, key="selected_tab", label_visibility="collapsed")
 
-with tab4:
-    show_controlnet_tab()
+module_name, function_name = TABS[selected_tab]
+show_tab = getattr(importlib.import_module(module_name), function_name)
+show_tab()
 
 # Footer
 st.markdown("---")
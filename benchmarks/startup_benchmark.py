@@ -0,0 +1,79 @@
+"""Measure app cold start and per-rerun time.
+
+Usage:
+    python benchmarks/startup_benchmark.py [--runs N]
+
+Cold start imports are timed in fresh interpreters so module caches don't
+hide the cost. Rerun timing uses Streamlit's AppTest (Streamlit >= 1.28).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_TARGETS = [
+    "streamlit",
+    "modules.server_config",
+    "modules.text_to_image",
+    "modules.image_to_image",
+    "modules.upscaler",
+    "modules.controlnet",
+]
+
+def time_import(module_name, runs):
+    """Return import times (seconds) of a module, each in a fresh interpreter"""
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module_name}; "
+        "print(time.perf_counter() - start)"
+    )
+    timings = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=ROOT)
+        timings.append(float(output.decode().strip().splitlines()[-1]))
+    return timings
+
+def time_reruns(runs):
+    """Return the time of the first script run and of subsequent reruns"""
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+
+    start = time.perf_counter()
+    app.run()
+    first_run = time.perf_counter() - start
+
+    reruns = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        app.run()
+        reruns.append(time.perf_counter() - start)
+    return first_run, reruns
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs per measurement")
+    args = parser.parse_args()
+
+    print("Cold import times (median over fresh interpreters):")
+    for module_name in IMPORT_TARGETS:
+        timings = time_import(module_name, args.runs)
+        print(f"  {module_name:<28} {statistics.median(timings) * 1000:8.1f} ms")
+
+    try:
+        os.chdir(ROOT)
+        first_run, reruns = time_reruns(args.runs)
+    except ImportError:
+        print("Rerun timing skipped: requires streamlit.testing (Streamlit >= 1.28)")
+        return
+
+    print("Script run times:")
+    print(f"  {'first run':<28} {first_run * 1000:8.1f} ms")
+    print(f"  {'rerun (median)':<28} {statistics.median(reruns) * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
 import streamlit as st
-import requests
 import base64
 from io import BytesIO
 from PIL import Image
+from modules.payload_cache import encode_image
+from modules.gallery import new_gallery, register_image, show_duplicate_notice
+from modules.progress import show_generation_controls, start_generation, get_pending_generation, iter_generation_results
+from modules.widget_state import persist, persistent_file_uploader
 
 def show_controlnet_tab():
     """Display the ControlNet tab with all its UI elements and functionality"""
@@ -21,7 +24,7 @@ def show_controlnet_tab():
     controlnet_models = st.session_state.get('controlnet_models', [])
     
     # Upload control image
-    uploaded_control_image = st.file_uploader("Upload Control Image", type=["png", "jpg", "jpeg"], key="controlnet_upload")
+    uploaded_control_image = persistent_file_uploader("Upload Control Image", key="controlnet_upload", type=["png", "jpg", "jpeg"])
     
     if uploaded_control_image is not None:
         control_image = Image.open(uploaded_control_image)
@@ -35,7 +38,7 @@ def show_controlnet_tab():
             
             with col1:
                 # Model selection
-                selected_model = st.selectbox("ControlNet Model", controlnet_models)
+                selected_model = st.selectbox("ControlNet Model", controlnet_models, key=persist("controlnet_model"))
                 
                 # Pre-processor
                 preprocessors = [
@@ -43,16 +46,16 @@ def show_controlnet_tab():
                     "hed", "mlsd", "normal_map", "openpose", "openpose_hand", 
                     "pidinet", "scribble", "fake_scribble", "segmentation"
                 ]
-                preprocessor = st.selectbox("Preprocessor", preprocessors)
+                preprocessor = st.selectbox("Preprocessor", preprocessors, key=persist("controlnet_preprocessor"))
                 
             with col2:
                 # Control parameters
-                control_weight = st.slider("Control Weight", min_value=0.0, max_value=1.0, value=1.0, step=0.05)
-                guidance_start = st.slider("Guidance Start", min_value=0.0, max_value=1.0, value=0.0, step=0.05)
-                guidance_end = st.slider("Guidance End", min_value=0.0, max_value=1.0, value=1.0, step=0.05)
+                control_weight = st.slider("Control Weight", min_value=0.0, max_value=1.0, value=1.0, step=0.05, key=persist("controlnet_weight"))
+                guidance_start = st.slider("Guidance Start", min_value=0.0, max_value=1.0, value=0.0, step=0.05, key=persist("controlnet_guidance_start"))
+                guidance_end = st.slider("Guidance End", min_value=0.0, max_value=1.0, value=1.0, step=0.05, key=persist("controlnet_guidance_end"))
                 
                 # Advanced options
-                advanced_options = st.checkbox("Show Advanced Options")
+                advanced_options = st.checkbox("Show Advanced Options", key=persist("controlnet_advanced"))
             
             if advanced_options:
                 col3, col4 = st.columns(2)
@@ -60,7 +63,7 @@ def show_controlnet_tab():
                 with col3:
                     control_mode = st.selectbox("Control Mode", [
                         "Balanced", "My prompt is more important", "ControlNet is more important"
-                    ])
+                    ], key=persist("controlnet_control_mode"))
                     
                     # Map mode selection to actual values
                     control_mode_map = {
@@ -71,7 +74,7 @@ def show_controlnet_tab():
                     
                     resize_mode = st.selectbox("Resize Mode", [
                         "Just Resize", "Crop and Resize", "Resize and Fill"
-                    ])
+                    ], key=persist("controlnet_resize_mode"))
                     
                     # Map resize mode to actual values
                     resize_mode_map = {
@@ -81,8 +84,8 @@ def show_controlnet_tab():
                     }
                 
                 with col4:
-                    lowvram = st.checkbox("Low VRAM", value=False)
-                    pixel_perfect = st.checkbox("Pixel Perfect", value=False)
+                    lowvram = st.checkbox("Low VRAM", value=False, key=persist("controlnet_lowvram"))
+                    pixel_perfect = st.checkbox("Pixel Perfect", value=False, key=persist("controlnet_pixel_perfect"))
             else:
                 # Default values
                 control_mode_map = {"Balanced": 0}
@@ -94,18 +97,18 @@ def show_controlnet_tab():
         
         # Prompt inputs
         st.subheader("Generation Parameters")
-        prompt = st.text_area("Prompt", "A beautiful landscape with mountains and a lake, photorealistic, detailed", key="controlnet_prompt")
-        negative_prompt = st.text_area("Negative Prompt", "blurry, low quality, deformed, ugly", key="controlnet_neg_prompt")
+        prompt = st.text_area("Prompt", "A beautiful landscape with mountains and a lake, photorealistic, detailed", key=persist("controlnet_prompt"))
+        negative_prompt = st.text_area("Negative Prompt", "blurry, low quality, deformed, ugly", key=persist("controlnet_neg_prompt"))
         
         # Generation parameters
         col1, col2, col3 = st.columns(3)
         with col1:
-            width = st.number_input("Width", min_value=64, max_value=2048, value=512, step=64, key="controlnet_width")
-            steps = st.number_input("Steps", min_value=1, max_value=150, value=20, key="controlnet_steps")
+            width = st.number_input("Width", min_value=64, max_value=2048, value=512, step=64, key=persist("controlnet_width"))
+            steps = st.number_input("Steps", min_value=1, max_value=150, value=20, key=persist("controlnet_steps"))
         
         with col2:
-            height = st.number_input("Height", min_value=64, max_value=2048, value=512, step=64, key="controlnet_height")
-            seed = st.number_input("Seed", min_value=-1, value=-1, key="controlnet_seed")
+            height = st.number_input("Height", min_value=64, max_value=2048, value=512, step=64, key=persist("controlnet_height"))
+            seed = st.number_input("Seed", min_value=-1, value=-1, key=persist("controlnet_seed"))
         
         with col3:
             samplers = st.session_state.get('samplers', [
@@ -114,81 +117,96 @@ def show_controlnet_tab():
                 "DPM2 Karras", "DPM2 a Karras", "DPM++ 2S a Karras", "DPM++ 2M Karras", 
                 "DPM++ SDE Karras", "DDIM", "PLMS"
             ])
-            sampler = st.selectbox("Sampler", samplers, index=0, key="controlnet_sampler")
-            cfg_scale = st.number_input("CFG Scale", min_value=1.0, max_value=30.0, value=7.0, step=0.5, key="controlnet_cfg")
+            sampler = st.selectbox("Sampler", samplers, index=0, key=persist("controlnet_sampler"))
+            cfg_scale = st.number_input("CFG Scale", min_value=1.0, max_value=30.0, value=7.0, step=0.5, key=persist("controlnet_cfg"))
+        
+        # Interrupt / skip controls for the running generation
+        show_generation_controls(sd_server, "controlnet")
         
         # Generate button
         if st.button("Generate Image with ControlNet", key="controlnet_generate"):
-            with st.spinner("Preprocessing and generating image..."):
-                # Convert control image to base64
-                buffered = BytesIO()
-                control_image.save(buffered, format="PNG")
-                img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
-                
-                # Prepare controlnet units
-                controlnet_unit = {
-                    "input_image": f"data:image/png;base64,{img_base64}",
-                    "model": selected_model,
-                    "weight": control_weight,
-                    "guidance_start": guidance_start,
-                    "guidance_end": guidance_end,
-                    "processor_res": max(width, height),  # Use the larger dimension
-                    "threshold_a": 64,  # Default value for most preprocessors
-                    "threshold_b": 64,  # Default value for most preprocessors
-                    "module": preprocessor,
-                    "control_mode": control_mode_map[control_mode],
-                    "resize_mode": resize_mode_map[resize_mode],
-                    "pixel_perfect": pixel_perfect,
-                    "lowvram": lowvram
-                }
-                
-                # Create main payload
-                payload = {
-                    "prompt": prompt,
-                    "negative_prompt": negative_prompt,
-                    "width": width,
-                    "height": height,
-                    "steps": steps,
-                    "cfg_scale": cfg_scale,
-                    "sampler_name": sampler,
-                    "seed": seed,
-                    "alwayson_scripts": {
-                        "controlnet": {
-                            "args": [controlnet_unit]
-                        }
+            # Convert control image to base64 (the encoding is reused while the image is unchanged)
+            img_data_uri = encode_image(control_image)
+            
+            # Prepare controlnet units
+            controlnet_unit = {
+                "input_image": img_data_uri,
+                "model": selected_model,
+                "weight": control_weight,
+                "guidance_start": guidance_start,
+                "guidance_end": guidance_end,
+                "processor_res": max(width, height),  # Use the larger dimension
+                "threshold_a": 64,  # Default value for most preprocessors
+                "threshold_b": 64,  # Default value for most preprocessors
+                "module": preprocessor,
+                "control_mode": control_mode_map[control_mode],
+                "resize_mode": resize_mode_map[resize_mode],
+                "pixel_perfect": pixel_perfect,
+                "lowvram": lowvram
+            }
+            
+            # Create main payload
+            payload = {
+                "prompt": prompt,
+                "negative_prompt": negative_prompt,
+                "width": width,
+                "height": height,
+                "steps": steps,
+                "cfg_scale": cfg_scale,
+                "sampler_name": sampler,
+                "seed": seed,
+                "alwayson_scripts": {
+                    "controlnet": {
+                        "args": [controlnet_unit]
                     }
                 }
-                
-                try:
-                    # Make API call to generate the image
-                    response = requests.post(f"{sd_server}/sdapi/v1/txt2img", json=payload)
+            }
+            
+            start_generation("controlnet", sd_server, "/sdapi/v1/txt2img", [payload])
+        
+        # Show the result of the current generation. It is kept in session state, so
+        # a rerun caused by Skip or any other click keeps collecting its result.
+        if get_pending_generation("controlnet") is not None:
+            with st.spinner("Preprocessing and generating image..."):
+                gallery = new_gallery()
+                for _, response, error in iter_generation_results("controlnet"):
+                    if error is not None:
+                        st.error(f"Error: {error}")
+                        continue
                     
-                    if response.status_code == 200:
-                        r = response.json()
-                        
-                        # Display generated image
-                        for i, img_data in enumerate(r['images']):
-                            # Skip control net visualization images (every second image)
-                            if i % 2 == 0:  # Only process the actual generated images
-                                image = Image.open(BytesIO(base64.b64decode(img_data.split(",", 1)[0])))
-                                st.image(image, caption="Generated Image", use_column_width=True)
-                                
-                                # Add a download button
-                                buf = BytesIO()
-                                image.save(buf, format="PNG")
-                                byte_im = buf.getvalue()
-                                st.download_button(
-                                    label="Download Image",
-                                    data=byte_im,
-                                    file_name=f"controlnet_generated_image.png",
-                                    mime="image/png",
-                                    key=f"download_controlnet"
-                                )
-                    else:
-                        st.error(f"Error: {response.status_code}, {response.text}")
-                except Exception as e:
-                    st.error(f"Error generating image: {e}")
-                    st.info("Make sure the ControlNet extension is properly installed and the server is running.")
+                    try:
+                        if response.status_code == 200:
+                            r = response.json()
+                            
+                            # Display generated image
+                            for i, img_data in enumerate(r['images']):
+                                # Skip control net visualization images (every second image)
+                                if i % 2 == 0:  # Only process the actual generated images
+                                    image = Image.open(BytesIO(base64.b64decode(img_data.split(",", 1)[0])))
+                                    
+                                    # Collapse near-duplicates within this generation
+                                    duplicate = register_image(image, "controlnet", gallery)
+                                    if duplicate is not None and show_duplicate_notice(duplicate):
+                                        continue
+                                    
+                                    st.image(image, caption="Generated Image", use_column_width=True)
+                                    
+                                    # Add a download button
+                                    buf = BytesIO()
+                                    image.save(buf, format="PNG")
+                                    byte_im = buf.getvalue()
+                                    st.download_button(
+                                        label="Download Image",
+                                        data=byte_im,
+                                        file_name=f"controlnet_generated_image.png",
+                                        mime="image/png",
+                                        key=f"download_controlnet"
+                                    )
+                        else:
+                            st.error(f"Error: {response.status_code}, {response.text}")
+                    except Exception as e:
+                        st.error(f"Error generating image: {e}")
+                        st.info("Make sure the ControlNet extension is properly installed and the server is running.")
     else:
         st.info("Please upload a control image to start. The image will guide the generation process based on the ControlNet model you select.")
         
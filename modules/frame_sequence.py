@@ -0,0 +1,322 @@
+import streamlit as st
+import base64
+import os
+import random
+import shutil
+import tempfile
+import time
+import zipfile
+from io import BytesIO
+from PIL import Image
+from modules import transport
+from modules.image_hash import dhash, hamming_distance
+from modules.widget_state import persist, persistent_file_uploader
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+VIDEO_EXTENSIONS = ["mp4", "mov", "avi", "mkv", "webm", "gif"]
+
+# Larger outputs are not offered for download; they stay in the output folder
+MAX_DOWNLOAD_SIZE = 500 * 1024 * 1024
+
+def iter_frames(source):
+    """Yield (index, image) pairs from a folder of images or a video file, one frame at a time"""
+    if os.path.isdir(source):
+        file_names = sorted(name for name in os.listdir(source) if name.lower().endswith(IMAGE_EXTENSIONS))
+        for index, file_name in enumerate(file_names):
+            with Image.open(os.path.join(source, file_name)) as frame:
+                yield index, frame.convert("RGB")
+        return
+
+    import cv2  # Only needed for video input
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video: {source}")
+    try:
+        index = 0
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield index, Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            index += 1
+    finally:
+        capture.release()
+
+def get_video_fps(source):
+    """Return the frame rate of a video file, or None for folders and unknown rates"""
+    if os.path.isdir(source):
+        return None
+    import cv2
+    capture = cv2.VideoCapture(source)
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    capture.release()
+    return fps or None
+
+def submit_frame(sd_server, base_payload, frame):
+    """Start img2img on a single frame and return a future of the response"""
+    size = (base_payload.get("width", frame.width), base_payload.get("height", frame.height))
+    if frame.size != size:
+        # Send frames at the output size rather than e.g. full 4K resolution
+        frame = frame.resize(size, Image.LANCZOS)
+
+    buffered = BytesIO()
+    frame.save(buffered, format="PNG")
+    img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+    payload = dict(base_payload, init_images=[f"data:image/png;base64,{img_base64}"], width=size[0], height=size[1])
+    return transport.submit_post(sd_server, "/sdapi/v1/img2img", payload)
+
+def decode_frame(response):
+    """Return the first generated image of an img2img response"""
+    if response.status_code != 200:
+        raise RuntimeError(f"Error: {response.status_code}, {response.text}")
+    img_data = response.json()['images'][0]
+    return Image.open(BytesIO(base64.b64decode(img_data.split(",", 1)[0])))
+
+class SequenceWriter:
+    """Write output frames to disk in order, optionally also encoding them into a video"""
+
+    def __init__(self, output_dir, fps=None):
+        self.output_dir = output_dir
+        self.fps = fps
+        self.video = None
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, index, image):
+        image.save(os.path.join(self.output_dir, f"frame_{index:05d}.png"))
+        if self.fps:
+            import cv2
+            import numpy as np
+            if self.video is None:
+                self.video = cv2.VideoWriter(os.path.join(self.output_dir, "output.mp4"),
+                                             cv2.VideoWriter_fourcc(*"mp4v"), self.fps, image.size)
+            self.video.write(cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2BGR))
+
+    def close(self):
+        if self.video is not None:
+            self.video.release()
+
+    def video_path(self):
+        """Return the path of the encoded video, or None if no video was written"""
+        return os.path.join(self.output_dir, "output.mp4") if self.video is not None else None
+
+def _frame_paths(output_dir):
+    return [os.path.join(output_dir, name) for name in sorted(os.listdir(output_dir))
+            if name.startswith("frame_") and name.endswith(".png")]
+
+def _zip_frames(output_dir):
+    """Return a zip archive of the written frames of an output folder"""
+    buffered = BytesIO()
+    # PNG frames are already compressed, so only store them
+    with zipfile.ZipFile(buffered, "w", compression=zipfile.ZIP_STORED) as archive:
+        for path in _frame_paths(output_dir):
+            archive.write(path, os.path.basename(path))
+    return buffered.getvalue()
+
+def _new_output_dir(base_dir):
+    """Create a fresh output folder for one run, removing the previous temporary one of this session"""
+    previous = st.session_state.pop('sequence_result', None)
+    if previous and previous["temporary"]:
+        shutil.rmtree(previous["output_dir"], ignore_errors=True)
+
+    if base_dir:
+        os.makedirs(base_dir, exist_ok=True)
+        return tempfile.mkdtemp(prefix=f"sequence_{time.strftime('%Y%m%d-%H%M%S')}_", dir=base_dir), False
+    return tempfile.mkdtemp(prefix="sd-sequence-"), True
+
+def _show_sequence_download():
+    """Offer the video (or a zip of the frames) of the last processed sequence.
+
+    The file is only read when the user asks for it, so reruns of the view
+    don't load (and re-register) the whole output each time.
+    """
+    result = st.session_state.get('sequence_result')
+    if not result or not result["done"] or not os.path.isdir(result["output_dir"]):
+        return
+
+    video_path = result["video_path"]
+    paths = [video_path] if video_path else _frame_paths(result["output_dir"])
+    if sum(os.path.getsize(path) for path in paths) > MAX_DOWNLOAD_SIZE:
+        st.caption(f"The output is too large to download here; it is in {result['output_dir']}")
+        return
+
+    label = "Video" if video_path else "Frames (zip)"
+    if st.button(f"Prepare {label} Download", key="sequence_prepare_download"):
+        if video_path:
+            with open(video_path, "rb") as f:
+                data = f.read()
+        else:
+            data = _zip_frames(result["output_dir"])
+        st.download_button(
+            label=f"Download {label}",
+            data=data,
+            file_name="output.mp4" if video_path else "frames.zip",
+            mime="video/mp4" if video_path else "application/zip",
+            key="download_sequence"
+        )
+
+def process_frame_sequence(sd_server, frames, base_payload, writer, max_workers=2, hash_threshold=4, on_progress=None):
+    """Stylize a stream of frames with img2img, reusing outputs for near-duplicate frames.
+
+    Frames within hash_threshold bits of the last generated keyframe reuse its
+    output. At most max_workers requests are in flight and 2 * max_workers
+    frames pending at once, and outputs are written in order as soon as they
+    are ready, so memory stays flat.
+    """
+    stats = {"written": 0, "generated": 0, "reused": 0}
+    pending = {}  # frame index -> response future for generated frames, True for reused frames
+    next_index = 0
+    keyframe_hash = None
+    last_output = None
+
+    def flush_next():
+        nonlocal next_index, last_output
+        entry = pending.pop(next_index)
+        if entry is True:
+            # Duplicates always follow their keyframe, which was written just before
+            stats["reused"] += 1
+        else:
+            last_output = decode_frame(entry.result())
+            stats["generated"] += 1
+        writer.write(next_index, last_output)
+        stats["written"] += 1
+        next_index += 1
+        if on_progress:
+            on_progress(stats)
+
+    def in_flight():
+        return sum(entry is not True for entry in pending.values())
+
+    try:
+        for index, frame in frames:
+            frame_hash = dhash(frame)
+            if keyframe_hash is not None and hamming_distance(frame_hash, keyframe_hash) <= hash_threshold:
+                pending[index] = True
+            else:
+                pending[index] = submit_frame(sd_server, base_payload, frame)
+                keyframe_hash = frame_hash
+
+            # Bound the number of requests in flight and frames held in memory
+            while pending and (in_flight() >= max_workers or len(pending) >= max_workers * 2):
+                flush_next()
+
+        while pending:
+            flush_next()
+    except BaseException:
+        for entry in pending.values():
+            if entry is not True:
+                entry.cancel()
+        raise
+    finally:
+        writer.close()
+
+    return stats
+
+def show_frame_sequence_mode(sd_server):
+    """Display the frame sequence UI of the Image to Image tab"""
+    source_type = st.radio("Sequence Source", ["Video File", "Frame Folder"], horizontal=True, key=persist("sequence_source"))
+
+    source_path = None
+    if source_type == "Video File":
+        uploaded_video = persistent_file_uploader("Upload a video", key="sequence_upload", type=VIDEO_EXTENSIONS)
+    else:
+        source_path = st.text_input("Frame Folder", "", key=persist("sequence_folder"),
+                                    help="Folder containing the frames as image files, processed in file name order")
+
+    base_output_dir = st.text_input("Output Folder", "", key=persist("sequence_output"),
+                                    help="Each run writes to a new subfolder; leave empty to use a temporary folder")
+
+    # Prompt inputs
+    prompt = st.text_area("Prompt", "A beautiful landscape with mountains and a lake, photorealistic, detailed", key=persist("sequence_prompt"))
+    negative_prompt = st.text_area("Negative Prompt", "blurry, low quality, deformed, ugly", key=persist("sequence_neg_prompt"))
+
+    # Output size; frames are resized to it before they are sent
+    size_col1, size_col2 = st.columns(2)
+    with size_col1:
+        width = st.number_input("Width", min_value=64, max_value=2048, value=512, step=64, key=persist("sequence_width"))
+    with size_col2:
+        height = st.number_input("Height", min_value=64, max_value=2048, value=512, step=64, key=persist("sequence_height"))
+
+    # Generation parameters
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        denoising_strength = st.slider("Denoising Strength", min_value=0.0, max_value=1.0, value=0.5, step=0.05, key=persist("sequence_denoising"))
+        steps = st.number_input("Steps", min_value=1, max_value=150, value=20, key=persist("sequence_steps"))
+        cfg_scale = st.number_input("CFG Scale", min_value=1.0, max_value=30.0, value=7.0, step=0.5, key=persist("sequence_cfg"))
+
+    with col2:
+        seed = st.number_input("Seed", min_value=-1, value=-1, key=persist("sequence_seed"),
+                               help="The same seed is used for every frame; -1 picks one random seed for the whole sequence")
+        samplers = st.session_state.get('samplers', [
+            "Euler a", "Euler", "LMS", "Heun", "DPM2", "DPM2 a", "DPM++ 2S a",
+            "DPM++ 2M", "DPM++ SDE", "DPM fast", "DPM adaptive", "LMS Karras",
+            "DPM2 Karras", "DPM2 a Karras", "DPM++ 2S a Karras", "DPM++ 2M Karras",
+            "DPM++ SDE Karras", "DDIM", "PLMS"
+        ])
+        sampler = st.selectbox("Sampler", samplers, index=0, key=persist("sequence_sampler"))
+
+    with col3:
+        hash_threshold = st.slider("Duplicate Threshold", min_value=0, max_value=16, value=4, key=persist("sequence_hash_threshold"),
+                                   help="Frames whose perceptual hash differs from the last generated frame by at most this many bits reuse its output (0 = exact duplicates only)")
+        max_workers = st.number_input("Concurrent Requests", min_value=1, max_value=8, value=2, key=persist("sequence_workers"))
+
+    if st.button("Process Sequence", key="sequence_generate"):
+        if source_type == "Video File" and uploaded_video is None:
+            st.warning("Please upload a video first.")
+            return
+        if source_type == "Frame Folder" and not os.path.isdir(source_path):
+            st.warning("Please enter an existing frame folder.")
+            return
+
+        if seed == -1:
+            seed = random.randint(0, 2**32 - 1)
+            st.info(f"Using seed {seed} for all frames")
+
+        base_payload = {
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+            "denoising_strength": denoising_strength,
+            "steps": steps,
+            "cfg_scale": cfg_scale,
+            "sampler_name": sampler,
+            "seed": seed,
+            "width": width,
+            "height": height
+        }
+
+        temp_path = None
+        status_text = st.empty()
+
+        def show_progress(stats):
+            status_text.text(f"Frames written: {stats['written']} (generated {stats['generated']}, reused {stats['reused']})")
+
+        try:
+            if source_type == "Video File":
+                # Stream the upload to disk so the video decoder can read it
+                suffix = os.path.splitext(uploaded_video.name)[1]
+                with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp_file:
+                    shutil.copyfileobj(uploaded_video, temp_file)
+                    temp_path = temp_file.name
+                source_path = temp_path
+
+            output_dir, temporary = _new_output_dir(base_output_dir)
+            # Remembered before processing so a failed run's folder is still cleaned up next time
+            st.session_state['sequence_result'] = {"output_dir": output_dir, "temporary": temporary, "video_path": None, "done": False}
+            writer = SequenceWriter(output_dir, fps=get_video_fps(source_path))
+            with st.spinner("Processing frames..."):
+                stats = process_frame_sequence(sd_server, iter_frames(source_path), base_payload, writer,
+                                               max_workers=max_workers, hash_threshold=hash_threshold,
+                                               on_progress=show_progress)
+            st.session_state['sequence_result'].update(video_path=writer.video_path(), done=True)
+            st.success(f"Wrote {stats['written']} frames to {output_dir} "
+                       f"({stats['generated']} generated, {stats['reused']} reused from near-duplicates)")
+        except ImportError:
+            st.error("Video input requires OpenCV. Install it with: pip install opencv-python-headless")
+        except Exception as e:
+            st.error(f"Error processing sequence: {e}")
+        finally:
+            if temp_path:
+                os.remove(temp_path)
+
+    _show_sequence_download()
@@ -0,0 +1,44 @@
+import streamlit as st
+import os
+from modules.image_hash import ImageHashIndex, phash
+
+def get_image_index(source, size):
+    """Return this session's perceptual-hash index of saved images of one source and size"""
+    max_distance = st.session_state.get('dedup_threshold', 6)
+    indexes = st.session_state.setdefault('image_indexes', {})
+    if (source, size) not in indexes:
+        indexes[(source, size)] = ImageHashIndex(max_distance)
+    index = indexes[(source, size)]
+    index.max_distance = max_distance
+    return index
+
+def new_gallery():
+    """Return an index that collapses near-duplicates within the gallery of one generation"""
+    return ImageHashIndex(st.session_state.get('dedup_threshold', 6))
+
+def register_image(image, source, gallery=None):
+    """Save a generated image to the output folder and add it to a generation's gallery.
+
+    Images are not saved again when they near-duplicate an earlier image of the
+    same source and size (pHash ignores size, so an upscale never matches its
+    original). Returns the entry of an earlier near-duplicate in the gallery,
+    or None if the image should be shown.
+    """
+    image_hash = phash(image)
+    number = st.session_state['image_count'] = st.session_state.get('image_count', 0) + 1
+    entry = {"source": source, "number": number, "path": None}
+
+    output_dir = st.session_state.get('output_dir', "")
+    if get_image_index(source, image.size).add_hash_if_new(image_hash, entry) is None and output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        entry["path"] = os.path.join(output_dir, f"{source}_{number:05d}.png")
+        image.save(entry["path"])
+
+    if gallery is None:
+        return None
+    return gallery.add_hash_if_new(image_hash, entry)
+
+def show_duplicate_notice(duplicate):
+    """Show a note for a near-duplicate image; returns True if it should be hidden from the gallery"""
+    st.caption(f"Near-duplicate of {duplicate['source']} image #{duplicate['number']}")
+    return st.session_state.get('collapse_duplicates', True)
@@ -0,0 +1,200 @@
+import os
+import threading
+import time
+
+# How often each server is probed
+HEALTH_CHECK_INTERVAL = float(os.environ.get("SD_HEALTH_CHECK_INTERVAL", "10"))
+
+# Timeout of a single probe request
+PROBE_TIMEOUT = 5.0
+
+# Consecutive failures that open a server's circuit, and how long it stays open
+FAILURE_THRESHOLD = 3
+RESET_TIMEOUT = 30.0
+
+# Servers nobody has used for this long are no longer probed
+IDLE_TIMEOUT = 600.0
+
+class BackendUnavailable(Exception):
+    """Raised instead of sending a request to a server whose circuit is open"""
+
+class CircuitBreaker:
+    """Fail fast after repeated failures of a server.
+
+    The circuit opens after failure_threshold consecutive failures. Once
+    reset_timeout has passed it becomes half-open and lets a single trial
+    request through; its success closes the circuit and its failure re-opens
+    it. A trial that reports nothing (e.g. cancelled) is replaced by a new one
+    after another reset_timeout.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def retry_in(self):
+        """Seconds until an open circuit becomes half-open"""
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def is_open(self):
+        """Whether requests are refused outright (a half-open circuit may still refuse all but its trial)"""
+        with self._lock:
+            return self._state() == self.OPEN
+
+    def allow_request(self):
+        """Whether a request may be sent; while half-open, only one trial request is allowed"""
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.OPEN:
+                return False
+            now = time.monotonic()
+            if self.trial_started_at is not None and now - self.trial_started_at < self.reset_timeout:
+                return False
+            self.trial_started_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_started_at = None
+            if self._state() == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+class ServerHealth:
+    """Latest probe results and circuit breaker of one server"""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self.latency_ms = None
+        self.vram_used = None
+        self.vram_total = None
+        self.job = None
+        self.last_error = None
+        self.last_checked = None
+        self.last_used = time.monotonic()
+
+class HealthMonitor:
+    """Background thread that periodically probes every server in use"""
+
+    def __init__(self, interval=HEALTH_CHECK_INTERVAL):
+        self.interval = interval
+        self._servers = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sd-health-monitor", daemon=True)
+        self._thread.start()
+
+    def register(self, sd_server):
+        """Start (or keep) monitoring a server and return its health"""
+        with self._lock:
+            if sd_server not in self._servers:
+                self._servers[sd_server] = ServerHealth()
+                self._wake.set()
+            health = self._servers[sd_server]
+            health.last_used = time.monotonic()
+            return health
+
+    def health(self, sd_server):
+        """Return the health of a server, registering it if needed"""
+        return self.register(sd_server)
+
+    def check(self, sd_server, trial=True):
+        """Raise BackendUnavailable if a request to the server may not be sent.
+
+        With trial=False the check only fails while the circuit is open and does
+        not use up the single request a half-open circuit allows.
+        """
+        health = self.register(sd_server)
+        allowed = health.breaker.allow_request() if trial else not health.breaker.is_open()
+        if not allowed:
+            raise BackendUnavailable(
+                f"Server {sd_server} is unavailable after {health.breaker.failures} failed requests"
+                f" ({health.last_error or 'no response'}). Retrying in {health.breaker.retry_in():.0f}s."
+            )
+
+    def _run(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                for sd_server in [server for server, health in self._servers.items() if now - health.last_used > IDLE_TIMEOUT]:
+                    del self._servers[sd_server]
+                servers = list(self._servers.items())
+
+            for sd_server, health in servers:
+                self._probe(sd_server, health)
+
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _probe(self, sd_server, health):
+        import requests  # Imported lazily to keep app start-up fast
+        try:
+            start = time.monotonic()
+            progress = requests.get(f"{sd_server}/sdapi/v1/progress", params={"skip_current_image": "true"}, timeout=PROBE_TIMEOUT)
+            progress.raise_for_status()
+            health.latency_ms = (time.monotonic() - start) * 1000
+            state = progress.json().get("state", {})
+            health.job = state.get("job") or None
+        except (requests.RequestException, ValueError) as e:
+            health.last_error = str(e)
+            health.breaker.record_failure()
+            health.last_checked = time.time()
+            return
+
+        health.last_error = None
+        health.breaker.record_success()
+
+        # VRAM usage is informational, and some builds lack /sdapi/v1/memory,
+        # so its failure doesn't count against the server
+        try:
+            memory = requests.get(f"{sd_server}/sdapi/v1/memory", timeout=PROBE_TIMEOUT)
+            memory.raise_for_status()
+            cuda = memory.json().get("cuda", {}).get("system", {})
+            health.vram_used = cuda.get("used")
+            health.vram_total = cuda.get("total")
+        except (requests.RequestException, ValueError, AttributeError):
+            health.vram_used = None
+            health.vram_total = None
+        health.last_checked = time.time()
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+def get_monitor():
+    """Return the process-wide health monitor, starting it on first use"""
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = HealthMonitor()
+        return _monitor
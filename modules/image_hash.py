@@ -0,0 +1,105 @@
+import numpy as np
+from functools import lru_cache
+from PIL import Image
+
+def dhash(image, hash_size=8):
+    """Difference hash: compare each pixel with its right neighbour on a downscaled grayscale image"""
+    pixels = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def hamming_distance(hash_a, hash_b):
+    """Number of differing bits between two hashes"""
+    return bin(hash_a ^ hash_b).count("1")
+
+@lru_cache(maxsize=None)
+def _dct_matrix(size):
+    """Orthonormal DCT-II matrix, so a 2D DCT is D @ X @ D.T"""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.sqrt(2.0 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+def phash(image, hash_size=8, highfreq_factor=4):
+    """Perceptual hash: threshold the low-frequency DCT coefficients of a downscaled grayscale image at their median"""
+    size = hash_size * highfreq_factor
+    pixels = np.asarray(image.convert("L").resize((size, size), Image.LANCZOS), dtype=np.float64)
+    dct_matrix = _dct_matrix(size)
+    low_frequencies = (dct_matrix @ pixels @ dct_matrix.T)[:hash_size, :hash_size]
+    bits = (low_frequencies > np.median(low_frequencies)).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+class BKTree:
+    """Burkhard-Keller tree for fast lookup of hashes within a Hamming distance"""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, item_hash, value):
+        """Add a hash with an associated value"""
+        self.size += 1
+        if self.root is None:
+            self.root = (item_hash, [value], {})
+            return
+
+        node = self.root
+        while True:
+            node_hash, values, children = node
+            distance = hamming_distance(item_hash, node_hash)
+            if distance == 0:
+                values.append(value)
+                return
+            if distance not in children:
+                children[distance] = (item_hash, [value], {})
+                return
+            node = children[distance]
+
+    def search(self, item_hash, max_distance):
+        """Return (distance, value) pairs within max_distance of a hash, closest first"""
+        results = []
+        candidates = [self.root] if self.root is not None else []
+        while candidates:
+            node_hash, values, children = candidates.pop()
+            distance = hamming_distance(item_hash, node_hash)
+            if distance <= max_distance:
+                results.extend((distance, value) for value in values)
+            # Triangle inequality: only subtrees in this distance band can match
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    candidates.append(child)
+        results.sort(key=lambda result: result[0])
+        return results
+
+class ImageHashIndex:
+    """Index of images by perceptual hash for near-duplicate detection"""
+
+    def __init__(self, max_distance=6):
+        self.max_distance = max_distance
+        self.tree = BKTree()
+
+    def __len__(self):
+        return len(self.tree)
+
+    def find_duplicate(self, image_hash):
+        """Return the value of the closest indexed image within max_distance, or None"""
+        matches = self.tree.search(image_hash, self.max_distance)
+        return matches[0][1] if matches else None
+
+    def add_if_new(self, image, value):
+        """Index an image unless a near-duplicate is already indexed.
+
+        Returns the value of the near-duplicate, or None if the image was added.
+        """
+        return self.add_hash_if_new(phash(image), value)
+
+    def add_hash_if_new(self, image_hash, value):
+        """Same as add_if_new() for an already computed perceptual hash"""
+        duplicate = self.find_duplicate(image_hash)
+        if duplicate is None:
+            self.tree.add(image_hash, value)
+        return duplicate
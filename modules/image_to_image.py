@@ -1,8 +1,13 @@
 import streamlit as st
-import requests
 import base64
 from io import BytesIO
 from PIL import Image
+from modules.payload_cache import encode_image
+from modules.gallery import new_gallery, register_image, show_duplicate_notice
+from modules.progress import show_generation_controls, start_generation, get_pending_generation, iter_generation_results
+from modules.prompt_templates import show_template_selector
+from modules.frame_sequence import show_frame_sequence_mode
+from modules.widget_state import persist, persistent_file_uploader
 
 def show_image_to_image_tab():
     """Display the Image to Image tab with all its UI elements and functionality"""
@@ -11,8 +16,14 @@ def show_image_to_image_tab():
     # Get server URL from session state
     sd_server = st.session_state.get('sd_server', "http://127.0.0.1:7860")
     
+    # Single image or frame sequence (video / frame folder) input
+    input_mode = st.radio("Input", ["Single Image", "Frame Sequence"], horizontal=True, key=persist("img2img_input_mode"))
+    if input_mode == "Frame Sequence":
+        show_frame_sequence_mode(sd_server)
+        return
+    
     # Upload image
-    uploaded_image = st.file_uploader("Upload an image", type=["png", "jpg", "jpeg"])
+    uploaded_image = persistent_file_uploader("Upload an image", key="img2img_upload", type=["png", "jpg", "jpeg"])
     
     # Image preprocessing options
     if uploaded_image is not None:
@@ -26,7 +37,7 @@ def show_image_to_image_tab():
             
         with col2:
             with st.expander("Image Preprocessing", expanded=True):
-                resize_factor = st.slider("Resize Factor", min_value=0.1, max_value=2.0, value=1.0, step=0.1)
+                resize_factor = st.slider("Resize Factor", min_value=0.1, max_value=2.0, value=1.0, step=0.1, key=persist("img2img_resize_factor"))
                 
                 if resize_factor != 1.0 and st.button("Resize Image"):
                     new_width = int(image.width * resize_factor)
@@ -39,48 +50,27 @@ def show_image_to_image_tab():
         if 'processed_image' not in st.session_state:
             st.session_state['processed_image'] = image
         
-        # Prompt inputs
-        prompt_img2img = st.text_area("Prompt", "A beautiful landscape with mountains and a lake, photorealistic, detailed", key="img2img_prompt")
-        negative_prompt_img2img = st.text_area("Negative Prompt", "blurry, low quality, deformed, ugly", key="img2img_neg_prompt")
+        # Prompt inputs (kept in session state so templates can be applied to them)
+        st.session_state.setdefault('img2img_prompt', "A beautiful landscape with mountains and a lake, photorealistic, detailed")
+        st.session_state.setdefault('img2img_neg_prompt', "blurry, low quality, deformed, ugly")
+        prompt_img2img = st.text_area("Prompt", key=persist("img2img_prompt"))
+        negative_prompt_img2img = st.text_area("Negative Prompt", key=persist("img2img_neg_prompt"))
         
         # Template selector
-        with st.expander("Prompt Templates", expanded=False):
-            templates = {
-                "None": {"prompt": "", "negative": ""},
-                "Photorealistic": {"prompt": "photorealistic, 8k, detailed, sharp focus", 
-                                  "negative": "cartoon, drawing, anime, illustration, painting"},
-                "Anime Style": {"prompt": "anime style, vibrant colors, detailed, illustration", 
-                               "negative": "photorealistic, 3d, photograph, realistic"},
-                "Oil Painting": {"prompt": "oil painting, detailed brushwork, artistic, textured canvas", 
-                                "negative": "digital art, 3d, photograph, sharp edges"}
-            }
-            
-            selected_template = st.selectbox("Select Template", list(templates.keys()), key="img2img_template")
-            
-            if selected_template != "None" and st.button("Apply Template", key="img2img_apply_template"):
-                # Append template to current prompts
-                if prompt_img2img:
-                    prompt_img2img += ", " + templates[selected_template]["prompt"]
-                else:
-                    prompt_img2img = templates[selected_template]["prompt"]
-                    
-                if negative_prompt_img2img:
-                    negative_prompt_img2img += ", " + templates[selected_template]["negative"]
-                else:
-                    negative_prompt_img2img = templates[selected_template]["negative"]
+        show_template_selector("img2img_prompt", "img2img_neg_prompt", "img2img")
         
         # Generation parameters
         col1, col2, col3 = st.columns(3)
         with col1:
-            denoising_strength = st.slider("Denoising Strength", min_value=0.0, max_value=1.0, value=0.75, step=0.05)
-            steps_img2img = st.number_input("Steps", min_value=1, max_value=150, value=20, key="img2img_steps")
-            cfg_scale_img2img = st.number_input("CFG Scale", min_value=1.0, max_value=30.0, value=7.0, step=0.5, key="img2img_cfg")
+            denoising_strength = st.slider("Denoising Strength", min_value=0.0, max_value=1.0, value=0.75, step=0.05, key=persist("img2img_denoising"))
+            steps_img2img = st.number_input("Steps", min_value=1, max_value=150, value=20, key=persist("img2img_steps"))
+            cfg_scale_img2img = st.number_input("CFG Scale", min_value=1.0, max_value=30.0, value=7.0, step=0.5, key=persist("img2img_cfg"))
         
         with col2:
             # Use original image dimensions by default
-            width_img2img = st.number_input("Width", min_value=64, max_value=2048, value=st.session_state['processed_image'].width, step=64, key="img2img_width")
-            height_img2img = st.number_input("Height", min_value=64, max_value=2048, value=st.session_state['processed_image'].height, step=64, key="img2img_height")
-            seed_img2img = st.number_input("Seed", min_value=-1, value=-1, key="img2img_seed")
+            width_img2img = st.number_input("Width", min_value=64, max_value=2048, value=st.session_state['processed_image'].width, step=64, key=persist("img2img_width"))
+            height_img2img = st.number_input("Height", min_value=64, max_value=2048, value=st.session_state['processed_image'].height, step=64, key=persist("img2img_height"))
+            seed_img2img = st.number_input("Seed", min_value=-1, value=-1, key=persist("img2img_seed"))
         
         with col3:
             samplers = st.session_state.get('samplers', [
@@ -89,12 +79,12 @@ def show_image_to_image_tab():
                 "DPM2 Karras", "DPM2 a Karras", "DPM++ 2S a Karras", "DPM++ 2M Karras", 
                 "DPM++ SDE Karras", "DDIM", "PLMS"
             ])
-            sampler_img2img = st.selectbox("Sampler", samplers, index=0, key="img2img_sampler")
-            restore_faces_img2img = st.checkbox("Restore Faces", value=False, key="img2img_restore_faces")
-            tiling_img2img = st.checkbox("Tiling", value=False, key="img2img_tiling")
+            sampler_img2img = st.selectbox("Sampler", samplers, index=0, key=persist("img2img_sampler"))
+            restore_faces_img2img = st.checkbox("Restore Faces", value=False, key=persist("img2img_restore_faces"))
+            tiling_img2img = st.checkbox("Tiling", value=False, key=persist("img2img_tiling"))
         
         # Generation modes
-        img2img_mode = st.radio("Generation Mode", ["Standard", "Inpainting", "Outpainting"], horizontal=True)
+        img2img_mode = st.radio("Generation Mode", ["Standard", "Inpainting", "Outpainting"], horizontal=True, key=persist("img2img_mode"))
         
         if img2img_mode == "Inpainting":
             st.info("Inpainting mode: Please use the Automatic1111 UI for inpainting as it requires complex image masking capabilities.")
@@ -102,75 +92,91 @@ def show_image_to_image_tab():
         elif img2img_mode == "Outpainting":
             outpainting_direction = st.selectbox("Outpainting Direction", 
                                                ["Left", "Right", "Top", "Bottom", "All Directions"],
-                                               index=4)
-            outpainting_pixels = st.slider("Pixels to Extend", min_value=32, max_value=512, value=128, step=32)
+                                               index=4, key=persist("img2img_outpainting_direction"))
+            outpainting_pixels = st.slider("Pixels to Extend", min_value=32, max_value=512, value=128, step=32, key=persist("img2img_outpainting_pixels"))
             
+        # Interrupt / skip controls for the running generation
+        show_generation_controls(sd_server, "img2img")
+        
         # Generate button
         if st.button("Generate Image", key="img2img_generate"):
-            with st.spinner("Generating image..."):
-                # Convert image to base64
-                buffered = BytesIO()
-                st.session_state['processed_image'].save(buffered, format="PNG")
-                img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
-                
-                # Basic payload
-                payload = {
-                    "init_images": [f"data:image/png;base64,{img_base64}"],
-                    "prompt": prompt_img2img,
-                    "negative_prompt": negative_prompt_img2img,
-                    "denoising_strength": denoising_strength,
-                    "width": width_img2img,
-                    "height": height_img2img,
-                    "steps": steps_img2img,
-                    "cfg_scale": cfg_scale_img2img,
-                    "sampler_name": sampler_img2img,
-                    "seed": seed_img2img,
-                    "restore_faces": restore_faces_img2img,
-                    "tiling": tiling_img2img
-                }
-                
-                # Modify payload for outpainting
-                if img2img_mode == "Outpainting":
-                    # This is a simplified approach; actual outpainting might require more complex handling
-                    # For a full implementation, you might need to adjust the canvas size and positioning
-                    if outpainting_direction == "Left":
-                        payload["width"] = width_img2img + outpainting_pixels
-                    elif outpainting_direction == "Right":
-                        payload["width"] = width_img2img + outpainting_pixels
-                    elif outpainting_direction == "Top":
-                        payload["height"] = height_img2img + outpainting_pixels
-                    elif outpainting_direction == "Bottom":
-                        payload["height"] = height_img2img + outpainting_pixels
-                    elif outpainting_direction == "All Directions":
-                        payload["width"] = width_img2img + outpainting_pixels * 2
-                        payload["height"] = height_img2img + outpainting_pixels * 2
-                    
-                    # For outpainting, use higher denoising strength
-                    payload["denoising_strength"] = max(0.8, denoising_strength)
+            # Convert image to base64 (the encoding is reused while the image is unchanged)
+            img_data_uri = encode_image(st.session_state['processed_image'])
+            
+            # Basic payload
+            payload = {
+                "init_images": [img_data_uri],
+                "prompt": prompt_img2img,
+                "negative_prompt": negative_prompt_img2img,
+                "denoising_strength": denoising_strength,
+                "width": width_img2img,
+                "height": height_img2img,
+                "steps": steps_img2img,
+                "cfg_scale": cfg_scale_img2img,
+                "sampler_name": sampler_img2img,
+                "seed": seed_img2img,
+                "restore_faces": restore_faces_img2img,
+                "tiling": tiling_img2img
+            }
+            
+            # Modify payload for outpainting
+            if img2img_mode == "Outpainting":
+                # This is a simplified approach; actual outpainting might require more complex handling
+                # For a full implementation, you might need to adjust the canvas size and positioning
+                if outpainting_direction == "Left":
+                    payload["width"] = width_img2img + outpainting_pixels
+                elif outpainting_direction == "Right":
+                    payload["width"] = width_img2img + outpainting_pixels
+                elif outpainting_direction == "Top":
+                    payload["height"] = height_img2img + outpainting_pixels
+                elif outpainting_direction == "Bottom":
+                    payload["height"] = height_img2img + outpainting_pixels
+                elif outpainting_direction == "All Directions":
+                    payload["width"] = width_img2img + outpainting_pixels * 2
+                    payload["height"] = height_img2img + outpainting_pixels * 2
                 
-                try:
-                    response = requests.post(f"{sd_server}/sdapi/v1/img2img", json=payload)
+                # For outpainting, use higher denoising strength
+                payload["denoising_strength"] = max(0.8, denoising_strength)
+            
+            start_generation("img2img", sd_server, "/sdapi/v1/img2img", [payload])
+        
+        # Show the result of the current generation. It is kept in session state, so
+        # a rerun caused by Skip or any other click keeps collecting its result.
+        if get_pending_generation("img2img") is not None:
+            with st.spinner("Generating image..."):
+                gallery = new_gallery()
+                for _, response, error in iter_generation_results("img2img"):
+                    if error is not None:
+                        st.error(f"Error: {error}")
+                        continue
                     
-                    if response.status_code == 200:
-                        r = response.json()
-                        for i, img_data in enumerate(r['images']):
-                            image = Image.open(BytesIO(base64.b64decode(img_data.split(",", 1)[0])))
-                            st.image(image, caption=f"Generated Image {i+1}", use_column_width=True)
-                            
-                            # Add a download button
-                            buf = BytesIO()
-                            image.save(buf, format="PNG")
-                            byte_im = buf.getvalue()
-                            st.download_button(
-                                label="Download Image",
-                                data=byte_im,
-                                file_name=f"generated_image_img2img_{i+1}.png",
-                                mime="image/png",
-                                key=f"download_img2img_{i+1}"
-                            )
-                    else:
-                        st.error(f"Error: {response.status_code}, {response.text}")
-                except Exception as e:
-                    st.error(f"Error: {e}")
+                    try:
+                        if response.status_code == 200:
+                            r = response.json()
+                            for i, img_data in enumerate(r['images']):
+                                image = Image.open(BytesIO(base64.b64decode(img_data.split(",", 1)[0])))
+                                
+                                # Collapse near-duplicates within this generation
+                                duplicate = register_image(image, "img2img", gallery)
+                                if duplicate is not None and show_duplicate_notice(duplicate):
+                                    continue
+                                
+                                st.image(image, caption=f"Generated Image {i+1}", use_column_width=True)
+                                
+                                # Add a download button
+                                buf = BytesIO()
+                                image.save(buf, format="PNG")
+                                byte_im = buf.getvalue()
+                                st.download_button(
+                                    label="Download Image",
+                                    data=byte_im,
+                                    file_name=f"generated_image_img2img_{i+1}.png",
+                                    mime="image/png",
+                                    key=f"download_img2img_{i+1}"
+                                )
+                        else:
+                            st.error(f"Error: {response.status_code}, {response.text}")
+                    except Exception as e:
+                        st.error(f"Error: {e}")
     else:
         st.info("Please upload an image to start.")
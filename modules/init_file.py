@@ -1,6 +1,20 @@
-# Import all modules to make them available when importing the package
-from modules.server_config import setup_sidebar
-from modules.text_to_image import show_text_to_image_tab
-from modules.image_to_image import show_image_to_image_tab
-from modules.upscaler import show_upscaler_tab
-from modules.controlnet import show_controlnet_tab
\ No newline at end of file
+# Make all modules available when importing the package. Tab modules (and with
+# them requests and PIL) are only imported the first time they are accessed.
+import importlib
+
+_LAZY_ATTRIBUTES = {
+    "setup_sidebar": "modules.server_config",
+    "show_text_to_image_tab": "modules.text_to_image",
+    "show_image_to_image_tab": "modules.image_to_image",
+    "show_upscaler_tab": "modules.upscaler",
+    "show_controlnet_tab": "modules.controlnet",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,91 @@
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+# Images are replaced by "upload-cache:<sha256>" references when the server supports it
+UPLOAD_REF_PREFIX = "upload-cache:"
+
+# Only data URIs at least this large are worth uploading separately
+MIN_UPLOAD_SIZE = 64 * 1024
+
+# How many digests of inlined images are remembered to notice when one repeats
+SEEN_DIGESTS_SIZE = 256
+
+# JSON bodies at least this large are gzip-compressed when the server supports it
+GZIP_MIN_SIZE = 64 * 1024
+
+_ENCODED_CACHE_SIZE = 16
+_encoded_images = OrderedDict()
+_encoded_lock = threading.Lock()
+
+def content_digest(data):
+    """SHA-256 hex digest of a string or bytes"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+def encode_image(image):
+    """Encode an image as a PNG data URI, reusing the encoding of identical images"""
+    key = content_digest(image.tobytes()) + f"-{image.mode}-{image.width}x{image.height}"
+    with _encoded_lock:
+        if key in _encoded_images:
+            _encoded_images.move_to_end(key)
+            return _encoded_images[key]
+
+    buffered = BytesIO()
+    image.save(buffered, format="PNG")
+    data_uri = f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode('utf-8')}"
+
+    with _encoded_lock:
+        _encoded_images[key] = data_uri
+        while len(_encoded_images) > _ENCODED_CACHE_SIZE:
+            _encoded_images.popitem(last=False)
+    return data_uri
+
+def extract_images(payload, min_size=MIN_UPLOAD_SIZE, select=None):
+    """Replace large data URIs in a JSON payload with upload-cache references.
+
+    If given, select(digest) decides which images are replaced; the others
+    stay inline. Returns the new payload and a dict mapping each replaced
+    digest to its data URI.
+    """
+    images = {}
+
+    def replace(value):
+        if isinstance(value, dict):
+            return {key: replace(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [replace(item) for item in value]
+        if isinstance(value, str) and len(value) >= min_size and value.startswith("data:image/"):
+            digest = content_digest(value)
+            if select is not None and not select(digest):
+                return value
+            images[digest] = value
+            return UPLOAD_REF_PREFIX + digest
+        return value
+
+    return replace(payload), images
+
+def resolve_references(payload, lookup):
+    """Replace upload-cache references in a JSON payload using lookup(digest).
+
+    Returns the new payload and the list of digests lookup() did not know.
+    """
+    missing = []
+
+    def resolve(value):
+        if isinstance(value, dict):
+            return {key: resolve(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [resolve(item) for item in value]
+        if isinstance(value, str) and value.startswith(UPLOAD_REF_PREFIX):
+            digest = value[len(UPLOAD_REF_PREFIX):]
+            data = lookup(digest)
+            if data is None:
+                missing.append(digest)
+            return data
+        return value
+
+    return resolve(payload), missing
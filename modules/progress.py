@@ -0,0 +1,180 @@
+import streamlit as st
+import base64
+import concurrent.futures
+import time
+from io import BytesIO
+from PIL import Image
+from streamlit.runtime.scriptrunner import StopException
+from modules import transport
+
+# Requests of one generation that are queued on the server at once. The rest
+# are submitted as earlier ones finish, so one session cannot fill the queue
+# shared by all users of a server.
+GENERATION_QUEUE_SIZE = 2
+
+def show_generation_controls(sd_server, key):
+    """Display Interrupt and Skip buttons that control the generation running on the server.
+
+    The server's interrupt and skip affect whatever job it is running, so they
+    are only sent while this session has a generation pending under key.
+    """
+    col1, col2 = st.columns(2)
+
+    with col1:
+        if st.button("Interrupt", key=f"{key}_interrupt", help="Stop the current generation and cancel the rest of the batch"):
+            if get_pending_generation(key) is None:
+                st.info("No generation is running")
+            else:
+                cancel_generation(key)
+                try:
+                    transport.post(sd_server, "/sdapi/v1/interrupt", bounded=False, timeout=5)
+                    st.info("Interrupt requested")
+                except Exception as e:
+                    st.error(f"Error interrupting generation: {e}")
+
+    with col2:
+        if st.button("Skip", key=f"{key}_skip", help="Skip the current image and continue with the rest of the batch"):
+            if get_pending_generation(key) is None:
+                st.info("No generation is running")
+            else:
+                try:
+                    transport.post(sd_server, "/sdapi/v1/skip", bounded=False, timeout=5)
+                    st.info("Skip requested")
+                except Exception as e:
+                    st.error(f"Error skipping image: {e}")
+
+def wait_with_preview(sd_server, future):
+    """Wait for an in-flight generation request while streaming live previews from /sdapi/v1/progress.
+
+    The wait updates an element on every pass, because Streamlit only stops a
+    run for a rerun (e.g. an Interrupt or Skip click) at the next st.* call.
+    """
+    live_preview = st.session_state.get('live_preview', True)
+    interval = st.session_state.get('preview_interval', 1.0)
+
+    progress_bar = st.progress(0) if live_preview else None
+    status_text = st.empty()
+    preview = st.empty()
+    started_at = time.monotonic()
+
+    while True:
+        done, _ = concurrent.futures.wait([future], timeout=interval)
+        if done:
+            break
+
+        progress = None
+        if live_preview:
+            try:
+                response = transport.get(
+                    sd_server,
+                    "/sdapi/v1/progress",
+                    params={"skip_current_image": "false"},
+                    timeout=max(interval, 1.0)
+                )
+                if response.status_code == 200:
+                    progress = response.json()
+                    state = progress.get("state", {})
+                    fraction = min(max(float(progress.get("progress", 0)), 0.0), 1.0)
+                    image = None
+                    if progress.get("current_image"):
+                        image = Image.open(BytesIO(base64.b64decode(progress["current_image"])))
+            except Exception:
+                # Progress polling is best effort; the generation request reports real errors
+                progress = None
+
+        if progress is None:
+            status_text.text(f"Generating... {time.monotonic() - started_at:.0f}s")
+            continue
+
+        progress_bar.progress(fraction)
+
+        if state.get("sampling_steps"):
+            status_text.text(
+                f"Step {state.get('sampling_step', 0)}/{state['sampling_steps']}"
+                f" - ETA {progress.get('eta_relative', 0):.1f}s"
+            )
+        else:
+            status_text.text(f"Generating... {time.monotonic() - started_at:.0f}s")
+
+        if image is not None:
+            preview.image(image, caption="Live Preview", use_column_width=True)
+
+    if progress_bar is not None:
+        progress_bar.empty()
+    status_text.empty()
+    preview.empty()
+
+    return future.result()
+
+def start_generation(key, sd_server, endpoint, payloads, **context):
+    """Start the requests of a Generate click and keep them in session state.
+
+    Any click (Skip, Interrupt or another widget) reruns the script and ends
+    the run that is waiting, so the next run picks the requests up again with
+    iter_generation_results() and shows their results. Only
+    GENERATION_QUEUE_SIZE requests are queued at a time; the rest are sent
+    while the results are collected.
+    """
+    st.session_state[f"{key}_pending"] = {
+        "sd_server": sd_server,
+        "endpoint": endpoint,
+        "payloads": list(payloads),
+        "futures": [],
+        "context": context,
+    }
+
+def get_pending_generation(key):
+    """Return the generation started under key that has not been fully shown yet, or None"""
+    return st.session_state.get(f"{key}_pending")
+
+def cancel_generation(key, keep_current=True):
+    """Cancel the requests of the pending generation under key that have not finished.
+
+    With keep_current, the earliest unfinished request is kept so its (partial)
+    result is still shown, e.g. after an interrupt.
+    """
+    pending = get_pending_generation(key)
+    if pending is None:
+        return
+
+    del pending["payloads"][len(pending["futures"]):]
+    unfinished = [future for future in pending["futures"] if not future.done()]
+    for future in unfinished[1 if keep_current else 0:]:
+        future.cancel()
+
+    if not keep_current:
+        st.session_state.pop(f"{key}_pending", None)
+
+def _submit_queued(pending):
+    """Submit the next requests of a generation until GENERATION_QUEUE_SIZE are unfinished"""
+    futures = pending["futures"]
+    while len(futures) < len(pending["payloads"]) and sum(not future.done() for future in futures) < GENERATION_QUEUE_SIZE:
+        payload = pending["payloads"][len(futures)]
+        futures.append(transport.submit_post(pending["sd_server"], pending["endpoint"], payload))
+
+def iter_generation_results(key):
+    """Wait for the pending generation under key, yielding (index, response, error) in order"""
+    pending = get_pending_generation(key)
+    if pending is None:
+        return
+
+    index = 0
+    try:
+        while index < len(pending["payloads"]):
+            _submit_queued(pending)
+            future = pending["futures"][index]
+            try:
+                response, error = wait_with_preview(pending["sd_server"], future), None
+            except concurrent.futures.CancelledError:
+                index += 1
+                continue
+            except Exception as e:
+                response, error = None, e
+            yield index, response, error
+            index += 1
+    except StopException:
+        # The user stopped the script; don't leave the rest of the batch running
+        cancel_generation(key, keep_current=False)
+        raise
+
+    st.session_state.pop(f"{key}_pending", None)
@@ -0,0 +1,140 @@
+import streamlit as st
+import os
+import re
+import json
+import itertools
+from functools import lru_cache
+from modules.widget_state import persist
+
+TEMPLATES_DIR = "templates"
+WILDCARDS_DIR = os.path.join(TEMPLATES_DIR, "wildcards")
+
+# Matches {a|b|c} groups and __wildcard__ references
+_TOKEN_PATTERN = re.compile(r"(\{|\}|\||__[\w\-/]+__)")
+
+@lru_cache(maxsize=None)
+def load_templates():
+    """Load style templates from every JSON file in the templates directory"""
+    templates = {"None": {"prompt": "", "negative": ""}}
+    if os.path.isdir(TEMPLATES_DIR):
+        for file_name in sorted(os.listdir(TEMPLATES_DIR)):
+            if file_name.endswith(".json"):
+                with open(os.path.join(TEMPLATES_DIR, file_name), "r") as f:
+                    templates.update(json.load(f))
+    return templates
+
+@lru_cache(maxsize=None)
+def load_wildcard(name):
+    """Load the options of a wildcard file (one option per line)"""
+    # Names come from prompts, so they must not reach files outside the wildcards folder
+    wildcards_dir = os.path.realpath(WILDCARDS_DIR)
+    path = os.path.realpath(os.path.join(wildcards_dir, f"{name}.txt"))
+    if os.path.isabs(name) or os.path.commonpath([wildcards_dir, path]) != wildcards_dir:
+        raise ValueError(f"Invalid wildcard: __{name}__")
+    if not os.path.exists(path):
+        raise ValueError(f"Unknown wildcard: __{name}__")
+    with open(path, "r") as f:
+        options = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return tuple(options)
+
+@lru_cache(maxsize=1024)
+def compile_template(text):
+    """Compile a prompt into a tuple of literal strings and groups of alternatives.
+
+    Each group is a tuple of alternatives, and each alternative is itself a
+    compiled sequence, so groups can be nested: "a {red|{dark|light} blue} car".
+    Wildcards (__name__) become a group with one alternative per line. Outside
+    groups "|" is plain text, so A1111's own [cow|horse] syntax passes through.
+    """
+    return _compile(text, wildcards=())
+
+def _compile(text, wildcards):
+    # wildcards holds the names of the wildcards being expanded, to detect cycles
+    tokens = [token for token in _TOKEN_PATTERN.split(text) if token]
+    sequence, position = _parse_sequence(tokens, 0, text, wildcards, nested=False)
+    return sequence
+
+def _parse_sequence(tokens, position, text, wildcards, nested):
+    sequence = []
+    while position < len(tokens):
+        token = tokens[position]
+        if token == "{":
+            group, position = _parse_group(tokens, position + 1, text, wildcards)
+            sequence.append(group)
+            continue
+        if token in ("|", "}") and nested:
+            break
+        if token == "}":
+            raise ValueError(f"Unexpected '}}' in prompt: {text}")
+        if token.startswith("__") and token.endswith("__"):
+            name = token[2:-2]
+            if name in wildcards:
+                cycle = " -> ".join(f"__{wildcard}__" for wildcard in wildcards + (name,))
+                raise ValueError(f"Wildcard refers to itself: {cycle}")
+            options = load_wildcard(name)
+            sequence.append(tuple(_compile(option, wildcards + (name,)) for option in options))
+        else:
+            sequence.append(token)
+        position += 1
+    return tuple(sequence), position
+
+def _parse_group(tokens, position, text, wildcards):
+    alternatives = []
+    while True:
+        alternative, position = _parse_sequence(tokens, position, text, wildcards, nested=True)
+        alternatives.append(alternative)
+        if position >= len(tokens):
+            raise ValueError(f"Unclosed '{{' in prompt: {text}")
+        if tokens[position] == "}":
+            return tuple(alternatives), position + 1
+        position += 1  # Skip "|"
+
+def _expand_sequence(sequence):
+    parts = []
+    for node in sequence:
+        if isinstance(node, str):
+            parts.append((node,))
+        else:
+            parts.append(itertools.chain.from_iterable(_expand_sequence(alternative) for alternative in node))
+    # itertools.product consumes each part once, so nested generators are safe here
+    for combination in itertools.product(*parts):
+        yield "".join(combination)
+
+def _count_sequence(sequence):
+    count = 1
+    for node in sequence:
+        if not isinstance(node, str):
+            count *= sum(_count_sequence(alternative) for alternative in node)
+    return count
+
+def count_expansions(text):
+    """Return how many concrete prompts a prompt expands to"""
+    return _count_sequence(compile_template(text))
+
+@lru_cache(maxsize=256)
+def expand_prompt(text, limit=None):
+    """Expand {a|b|c} groups and __wildcards__ into a tuple of concrete prompts"""
+    return tuple(itertools.islice(_expand_sequence(compile_template(text)), limit))
+
+def _apply_template(template_key, prompt_key, negative_key):
+    """Append the selected template to the prompts stored in session state"""
+    template = load_templates()[st.session_state[template_key]]
+    for state_key, addition in ((prompt_key, template["prompt"]), (negative_key, template["negative"])):
+        current = st.session_state.get(state_key, "")
+        if addition:
+            st.session_state[state_key] = f"{current}, {addition}" if current else addition
+
+def show_template_selector(prompt_key, negative_key, key_prefix, show_expansion_help=False):
+    """Display the template selector that appends a template to the given prompt text areas"""
+    with st.expander("Prompt Templates", expanded=False):
+        templates = load_templates()
+        template_key = f"{key_prefix}_template"
+        selected_template = st.selectbox("Select Template", list(templates.keys()), key=persist(template_key))
+
+        st.button("Apply Template", key=f"{key_prefix}_apply_template",
+                  disabled=selected_template == "None",
+                  on_click=_apply_template, args=(template_key, prompt_key, negative_key))
+
+        if show_expansion_help:
+            st.caption("Prompts also support {a|b|c} alternatives and __wildcard__ files from "
+                       f"{WILDCARDS_DIR}, e.g. \"a castle, {{oil painting|watercolor}}, __lighting__\".")
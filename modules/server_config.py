@@ -1,7 +1,32 @@
 import streamlit as st
-import requests
 import os
 import json
+from modules.health import get_monitor, CircuitBreaker, HEALTH_CHECK_INTERVAL
+
+def _show_backend_status(sd_server):
+    """Display the latest health probe results of the server"""
+    health = get_monitor().register(sd_server)
+    state = health.breaker.state
+    
+    if health.last_checked is None:
+        st.caption("Backend status: checking...")
+    elif state == CircuitBreaker.OPEN:
+        st.error(f"Backend unavailable - retrying in {health.breaker.retry_in():.0f}s")
+        st.caption(health.last_error or "")
+    elif state == CircuitBreaker.HALF_OPEN:
+        st.warning("Backend recovering")
+    else:
+        status = f"Backend online - {health.latency_ms:.0f} ms" if health.latency_ms is not None else "Backend online"
+        if health.job:
+            status += " - busy"
+        st.success(status)
+        if health.vram_total:
+            st.progress(min(health.vram_used / health.vram_total, 1.0))
+            st.caption(f"VRAM: {health.vram_used / 1024**3:.1f} / {health.vram_total / 1024**3:.1f} GB")
+
+# Refresh the status on its own when the installed Streamlit supports fragments
+if hasattr(st, "fragment"):
+    _show_backend_status = st.fragment(run_every=HEALTH_CHECK_INTERVAL)(_show_backend_status)
 
 def setup_sidebar():
     """Setup sidebar with server configuration and model selection options"""
@@ -29,9 +54,30 @@ def setup_sidebar():
         
         st.info("Make sure the Automatic1111 server is running with the --api and --listen arguments.")
         
+        # Live backend health from the background monitor
+        _show_backend_status(sd_server)
+        
+        # Live preview settings used by the generation tabs
+        with st.expander("Live Preview"):
+            st.session_state['live_preview'] = st.checkbox("Show live preview while generating", value=True)
+            st.session_state['preview_interval'] = st.slider("Preview refresh interval (seconds)", min_value=0.2, max_value=5.0, value=1.0, step=0.1,
+                                                             help="How often to poll the server for intermediate images")
+        
+        # Near-duplicate detection and saving of generated images
+        with st.expander("Output Gallery"):
+            st.session_state['collapse_duplicates'] = st.checkbox("Collapse near-duplicate images", value=True,
+                                                                  help="Hide images that nearly repeat an earlier image of the same generation")
+            st.session_state['dedup_threshold'] = st.slider("Duplicate threshold (bits)", min_value=0, max_value=16, value=6,
+                                                            help="Images whose perceptual hashes differ by at most this many bits are treated as duplicates")
+            st.session_state['output_dir'] = st.text_input("Save images to folder", "",
+                                                           help="Leave empty to keep images in the browser only. Near-duplicates of saved images of the same size are not saved again.")
+            if 'image_indexes' in st.session_state:
+                st.caption(f"Unique images this session: {sum(len(index) for index in st.session_state['image_indexes'].values())}")
+        
         st.header("Model Selection")
         # Get available models (if server is reachable)
         if st.button("Connect to Server"):
+            import requests  # Imported lazily to keep app start-up fast
             try:
                 response = requests.get(f"{sd_server}/sdapi/v1/sd-models")
                 if response.status_code == 200:
@@ -71,6 +117,7 @@ def setup_sidebar():
             if 'models' in st.session_state:
                 selected_model = st.selectbox("Select Model", st.session_state['models'])
                 if st.button("Set Model"):
+                    import requests
                     try:
                         response = requests.post(
                             f"{sd_server}/sdapi/v1/options", 
@@ -91,6 +138,7 @@ def setup_sidebar():
                 
                 # Save or apply advanced settings
                 if st.button("Apply Advanced Settings"):
+                    import requests
                     try:
                         response = requests.post(
                             f"{sd_server}/sdapi/v1/options", 
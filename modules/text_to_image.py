@@ -1,8 +1,11 @@
 import streamlit as st
-import requests
 import base64
 from io import BytesIO
 from PIL import Image
+from modules.gallery import new_gallery, register_image, show_duplicate_notice
+from modules.progress import show_generation_controls, start_generation, get_pending_generation, iter_generation_results
+from modules.prompt_templates import show_template_selector, expand_prompt, count_expansions
+from modules.widget_state import persist
 
 def show_text_to_image_tab():
     """Display the Text to Image tab with all its UI elements and functionality"""
@@ -11,50 +14,41 @@ def show_text_to_image_tab():
     # Get server URL from session state
     sd_server = st.session_state.get('sd_server', "http://127.0.0.1:7860")
     
-    # Prompt inputs
-    prompt = st.text_area("Prompt", "A beautiful landscape with mountains and a lake, photorealistic, detailed")
-    negative_prompt = st.text_area("Negative Prompt", "blurry, low quality, deformed, ugly")
+    # Prompt inputs (kept in session state so templates can be applied to them)
+    st.session_state.setdefault('txt2img_prompt', "A beautiful landscape with mountains and a lake, photorealistic, detailed")
+    st.session_state.setdefault('txt2img_neg_prompt', "blurry, low quality, deformed, ugly")
+    prompt = st.text_area("Prompt", key=persist("txt2img_prompt"))
+    negative_prompt = st.text_area("Negative Prompt", key=persist("txt2img_neg_prompt"))
     
     # Template selector
-    with st.expander("Prompt Templates", expanded=False):
-        templates = {
-            "None": {"prompt": "", "negative": ""},
-            "Photorealistic": {"prompt": "photorealistic, 8k, detailed, sharp focus", 
-                              "negative": "cartoon, drawing, anime, illustration, painting"},
-            "Anime Style": {"prompt": "anime style, vibrant colors, detailed, illustration", 
-                           "negative": "photorealistic, 3d, photograph, realistic"},
-            "Oil Painting": {"prompt": "oil painting, detailed brushwork, artistic, textured canvas", 
-                            "negative": "digital art, 3d, photograph, sharp edges"}
-        }
-        
-        selected_template = st.selectbox("Select Template", list(templates.keys()))
-        
-        if selected_template != "None" and st.button("Apply Template"):
-            # Append template to current prompts
-            if prompt:
-                prompt += ", " + templates[selected_template]["prompt"]
-            else:
-                prompt = templates[selected_template]["prompt"]
-                
-            if negative_prompt:
-                negative_prompt += ", " + templates[selected_template]["negative"]
-            else:
-                negative_prompt = templates[selected_template]["negative"]
-                
-            # Force refresh of text areas
-            st.experimental_set_query_params()
+    show_template_selector("txt2img_prompt", "txt2img_neg_prompt", "txt2img", show_expansion_help=True)
+    
+    # Prompt expansion: {a|b|c} alternatives and __wildcards__ become one generation per prompt
+    prompts = [prompt]
+    expand_prompts = st.checkbox("Expand prompt combinations", value=False,
+                                 help="Generate every combination of {a|b|c} groups and __wildcards__ in the prompt", key=persist("txt2img_expand"))
+    if expand_prompts:
+        max_prompts = st.number_input("Max Prompts", min_value=1, max_value=1000, value=16, key=persist("txt2img_max_prompts"))
+        try:
+            prompts = list(expand_prompt(prompt, limit=max_prompts))
+            st.caption(f"{len(prompts)} of {count_expansions(prompt)} combinations will be generated")
+            with st.expander("Expanded Prompts", expanded=False):
+                st.text("\n".join(prompts))
+        except ValueError as e:
+            st.error(f"Error expanding prompt: {e}")
+            prompts = []
     
     # Generation parameters
     col1, col2, col3 = st.columns(3)
     with col1:
-        width = st.number_input("Width", min_value=64, max_value=2048, value=512, step=64)
-        steps = st.number_input("Steps", min_value=1, max_value=150, value=20)
-        cfg_scale = st.number_input("CFG Scale", min_value=1.0, max_value=30.0, value=7.0, step=0.5)
+        width = st.number_input("Width", min_value=64, max_value=2048, value=512, step=64, key=persist("txt2img_width"))
+        steps = st.number_input("Steps", min_value=1, max_value=150, value=20, key=persist("txt2img_steps"))
+        cfg_scale = st.number_input("CFG Scale", min_value=1.0, max_value=30.0, value=7.0, step=0.5, key=persist("txt2img_cfg"))
     
     with col2:
-        height = st.number_input("Height", min_value=64, max_value=2048, value=512, step=64)
-        seed = st.number_input("Seed", min_value=-1, value=-1)
-        batch_size = st.number_input("Batch Size", min_value=1, max_value=4, value=1)
+        height = st.number_input("Height", min_value=64, max_value=2048, value=512, step=64, key=persist("txt2img_height"))
+        seed = st.number_input("Seed", min_value=-1, value=-1, key=persist("txt2img_seed"))
+        batch_size = st.number_input("Batch Size", min_value=1, max_value=4, value=1, key=persist("txt2img_batch_size"))
     
     with col3:
         samplers = st.session_state.get('samplers', [
@@ -63,101 +57,130 @@ def show_text_to_image_tab():
             "DPM2 Karras", "DPM2 a Karras", "DPM++ 2S a Karras", "DPM++ 2M Karras", 
             "DPM++ SDE Karras", "DDIM", "PLMS"
         ])
-        sampler = st.selectbox("Sampler", samplers, index=0)
-        restore_faces = st.checkbox("Restore Faces", value=False)
-        tiling = st.checkbox("Tiling", value=False)
+        sampler = st.selectbox("Sampler", samplers, index=0, key=persist("txt2img_sampler"))
+        restore_faces = st.checkbox("Restore Faces", value=False, key=persist("txt2img_restore_faces"))
+        tiling = st.checkbox("Tiling", value=False, key=persist("txt2img_tiling"))
     
     # Advanced options
     with st.expander("Advanced Options", expanded=False):
-        enable_hr = st.checkbox("High Resolution Fix", value=False)
+        enable_hr = st.checkbox("High Resolution Fix", value=False, key=persist("txt2img_enable_hr"))
         if enable_hr:
-            hr_scale = st.slider("Upscale by", min_value=1.0, max_value=4.0, value=2.0, step=0.1)
+            hr_scale = st.slider("Upscale by", min_value=1.0, max_value=4.0, value=2.0, step=0.1, key=persist("txt2img_hr_scale"))
             hr_upscaler = st.selectbox("Upscaler", 
                                       ["Latent", "Nearest", "ESRGAN_4x", "LDSR", "R-ESRGAN 4x+", "ScuNET GAN"],
-                                      index=0)
-            hr_second_pass_steps = st.slider("HR Steps", min_value=0, max_value=150, value=0)
+                                      index=0, key=persist("txt2img_hr_upscaler"))
+            hr_second_pass_steps = st.slider("HR Steps", min_value=0, max_value=150, value=0, key=persist("txt2img_hr_steps"))
         
+    # Interrupt / skip controls for the running generation
+    show_generation_controls(sd_server, "txt2img")
+    
     # Generate button
     if st.button("Generate Image", key="txt2img_generate"):
+        base_payload = {
+            "negative_prompt": negative_prompt,
+            "width": width,
+            "height": height,
+            "steps": steps,
+            "cfg_scale": cfg_scale,
+            "sampler_name": sampler,
+            "seed": seed,
+            "batch_size": batch_size,
+            "restore_faces": restore_faces,
+            "tiling": tiling
+        }
+        
+        # Add high-res options if enabled
+        if enable_hr:
+            base_payload.update({
+                "enable_hr": True,
+                "hr_scale": hr_scale,
+                "hr_upscaler": hr_upscaler,
+                "hr_second_pass_steps": hr_second_pass_steps if hr_second_pass_steps > 0 else steps
+            })
+        
+        # One request per expanded prompt, all sharing the same parameters
+        start_generation("txt2img", sd_server, "/sdapi/v1/txt2img",
+                         [dict(base_payload, prompt=prompt_text) for prompt_text in prompts],
+                         prompts=prompts, batch_size=batch_size)
+    
+    # Show the results of the current generation. It is kept in session state, so
+    # a rerun caused by Skip or any other click keeps collecting its results.
+    pending = get_pending_generation("txt2img")
+    if pending is not None:
+        prompts = pending["context"]["prompts"]
+        batch_size = pending["context"]["batch_size"]
+        
         with st.spinner("Generating image..."):
-            payload = {
-                "prompt": prompt,
-                "negative_prompt": negative_prompt,
-                "width": width,
-                "height": height,
-                "steps": steps,
-                "cfg_scale": cfg_scale,
-                "sampler_name": sampler,
-                "seed": seed,
-                "batch_size": batch_size,
-                "restore_faces": restore_faces,
-                "tiling": tiling
-            }
-            
-            # Add high-res options if enabled
-            if enable_hr:
-                payload.update({
-                    "enable_hr": True,
-                    "hr_scale": hr_scale,
-                    "hr_upscaler": hr_upscaler,
-                    "hr_second_pass_steps": hr_second_pass_steps if hr_second_pass_steps > 0 else steps
-                })
-            
-            try:
-                response = requests.post(f"{sd_server}/sdapi/v1/txt2img", json=payload)
+            gallery = new_gallery()
+            for prompt_idx, response, error in iter_generation_results("txt2img"):
+                prompt_text = prompts[prompt_idx]
+                if len(prompts) > 1:
+                    st.subheader(f"Prompt {prompt_idx+1}/{len(prompts)}")
+                    st.caption(prompt_text)
+                
+                if error is not None:
+                    st.error(f"Error: {error}")
+                    continue
                 
-                if response.status_code == 200:
-                    r = response.json()
-                    
-                    # Create columns for multiple images
-                    if batch_size > 1:
-                        img_columns = st.columns(min(batch_size, 4))  # Max 4 columns
-                    
-                    for i, img_data in enumerate(r['images']):
-                        image = Image.open(BytesIO(base64.b64decode(img_data.split(",", 1)[0])))
+                try:
+                    if response.status_code == 200:
+                        r = response.json()
                         
-                        # If multiple images, use columns
+                        # Create columns for multiple images
                         if batch_size > 1:
-                            col_idx = i % len(img_columns)
-                            with img_columns[col_idx]:
-                                st.image(image, caption=f"Image {i+1}", use_column_width=True)
+                            img_columns = st.columns(min(batch_size, 4))  # Max 4 columns
+                        
+                        for i, img_data in enumerate(r['images']):
+                            image = Image.open(BytesIO(base64.b64decode(img_data.split(",", 1)[0])))
+                            
+                            # Collapse near-duplicates within this generation
+                            duplicate = register_image(image, "txt2img", gallery)
+                            if duplicate is not None and show_duplicate_notice(duplicate):
+                                continue
+                            
+                            # If multiple images, use columns
+                            if batch_size > 1:
+                                col_idx = i % len(img_columns)
+                                with img_columns[col_idx]:
+                                    st.image(image, caption=f"Image {i+1}", use_column_width=True)
+                                    
+                                    # Add a download button
+                                    buf = BytesIO()
+                                    image.save(buf, format="PNG")
+                                    byte_im = buf.getvalue()
+                                    st.download_button(
+                                        label="Download",
+                                        data=byte_im,
+                                        file_name=f"generated_image_{prompt_idx+1}_{i+1}.png",
+                                        mime="image/png",
+                                        key=f"download_{prompt_idx+1}_{i+1}"
+                                    )
+                            else:
+                                # Single image - use full width
+                                st.image(image, caption="Generated Image", use_column_width=True)
+                                
+                                # Add download and info buttons
+                                col1, col2 = st.columns(2)
                                 
-                                # Add a download button
+                                # Download button
                                 buf = BytesIO()
                                 image.save(buf, format="PNG")
                                 byte_im = buf.getvalue()
-                                st.download_button(
-                                    label="Download",
-                                    data=byte_im,
-                                    file_name=f"generated_image_{i+1}.png",
-                                    mime="image/png",
-                                    key=f"download_{i+1}"
-                                )
-                        else:
-                            # Single image - use full width
-                            st.image(image, caption="Generated Image", use_column_width=True)
-                            
-                            # Add download and info buttons
-                            col1, col2 = st.columns(2)
-                            
-                            # Download button
-                            buf = BytesIO()
-                            image.save(buf, format="PNG")
-                            byte_im = buf.getvalue()
-                            
-                            with col1:
-                                st.download_button(
-                                    label="Download Image",
-                                    data=byte_im,
-                                    file_name="generated_image.png",
-                                    mime="image/png"
-                                )
-                            
-                            with col2:
-                                if st.button("View Generation Info"):
-                                    # Display generation parameters
-                                    st.json(r['parameters'])
-                else:
-                    st.error(f"Error: {response.status_code}, {response.text}")
-            except Exception as e:
-                st.error(f"Error: {e}")
+                                
+                                with col1:
+                                    st.download_button(
+                                        label="Download Image",
+                                        data=byte_im,
+                                        file_name=f"generated_image_{prompt_idx+1}.png" if len(prompts) > 1 else "generated_image.png",
+                                        mime="image/png",
+                                        key=f"download_single_{prompt_idx+1}"
+                                    )
+                                
+                                with col2:
+                                    with st.expander("View Generation Info"):
+                                        # Display generation parameters
+                                        st.json(r['parameters'])
+                    else:
+                        st.error(f"Error: {response.status_code}, {response.text}")
+                except Exception as e:
+                    st.error(f"Error: {e}")
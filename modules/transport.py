@@ -0,0 +1,276 @@
+import asyncio
+import concurrent.futures
+import gzip
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import httpx
+from modules.health import IDLE_TIMEOUT, get_monitor
+from modules.payload_cache import GZIP_MIN_SIZE, SEEN_DIGESTS_SIZE, extract_images
+
+# Maximum number of generation requests in flight per backend server
+MAX_CONCURRENCY = int(os.environ.get("SD_MAX_CONCURRENCY", "4"))
+
+# Longest a single request may take once sent, e.g. a large batch or high-res generation
+REQUEST_TIMEOUT = float(os.environ.get("SD_REQUEST_TIMEOUT", "600"))
+
+# Endpoints of the optional upload-cache proxy (see modules/upload_cache_proxy.py)
+UPLOAD_CACHE_PATH = "/upload-cache/v1"
+
+# How long to trust whether a server supports the upload cache before checking again
+FEATURE_CHECK_INTERVAL = 60.0
+
+# Responses that count as a failure of the server for its circuit breaker
+UNAVAILABLE_STATUS_CODES = (502, 503, 504)
+
+# How often to check for ended sessions whose requests should be cancelled
+SESSION_REAP_INTERVAL = 5.0
+
+def _current_session_id():
+    """Return the id of the Streamlit session running this thread, if any"""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        return ctx.session_id if ctx else None
+    except Exception:
+        return None
+
+def _is_active_session(session_id):
+    try:
+        from streamlit.runtime import Runtime
+        return Runtime.instance().is_active_session(session_id)
+    except Exception:
+        # Without runtime information, never cancel
+        return True
+
+class AsyncTransport:
+    """HTTP transport running on a long-lived background event loop.
+
+    Requests are submitted from Streamlit script threads and return
+    concurrent.futures.Future objects, so a session can have many requests in
+    flight. Bounded requests share a semaphore per backend server, and requests
+    of sessions that have ended are cancelled.
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.loop = asyncio.new_event_loop()
+        self._clients = {}
+        self._semaphores = {}
+        self._session_futures = {}
+        self._features = {}
+        self._uploaded = {}
+        self._seen = {}
+        self._in_use = {}
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self.loop.run_forever, name="sd-transport", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._reap_sessions(), self.loop)
+
+    def _client(self, sd_server):
+        # Called on the event loop thread only
+        if sd_server not in self._clients:
+            self._clients[sd_server] = httpx.AsyncClient(base_url=sd_server, timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=10.0))
+        return self._clients[sd_server]
+
+    def _semaphore(self, sd_server):
+        # Called on the event loop thread only
+        if sd_server not in self._semaphores:
+            self._semaphores[sd_server] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[sd_server]
+
+    def _acquire_server(self, sd_server):
+        # Called on the event loop thread only; servers in use are never closed as idle
+        self._in_use[sd_server] = self._in_use.get(sd_server, 0) + 1
+
+    def _release_server(self, sd_server):
+        self._in_use[sd_server] -= 1
+        self._last_used[sd_server] = time.monotonic()
+
+    async def _request(self, method, sd_server, endpoint, bounded, **kwargs):
+        self._acquire_server(sd_server)
+        try:
+            if bounded:
+                async with self._semaphore(sd_server):
+                    return await self._send(method, sd_server, endpoint, **kwargs)
+            return await self._send(method, sd_server, endpoint, **kwargs)
+        finally:
+            self._release_server(sd_server)
+
+    async def _send(self, method, sd_server, endpoint, **kwargs):
+        # Fail fast while the server's circuit is open instead of waiting on a dead backend
+        monitor = get_monitor()
+        monitor.check(sd_server)
+        breaker = monitor.health(sd_server).breaker
+
+        try:
+            response = await self._client(sd_server).request(method, endpoint, **kwargs)
+        except httpx.TransportError:
+            breaker.record_failure()
+            raise
+
+        if response.status_code in UNAVAILABLE_STATUS_CODES:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    async def _server_features(self, sd_server):
+        """Return the features advertised by an upload-cache proxy, or {} for a plain server"""
+        features, checked_at = self._features.get(sd_server, ({}, None))
+        if checked_at is None or time.monotonic() - checked_at > FEATURE_CHECK_INTERVAL:
+            try:
+                response = await self._client(sd_server).get(f"{UPLOAD_CACHE_PATH}/ping", timeout=2.0)
+                features = response.json() if response.status_code == 200 else {}
+            except (httpx.HTTPError, ValueError):
+                features = {}
+            self._features[sd_server] = (features, time.monotonic())
+        return features
+
+    async def _send_body(self, method, sd_server, endpoint, body, content_type, features, bounded):
+        headers = {"Content-Type": content_type}
+        if features.get("gzip") and len(body) >= GZIP_MIN_SIZE:
+            # Compress off the event loop so other requests keep flowing
+            body = await self.loop.run_in_executor(None, gzip.compress, body)
+            headers["Content-Encoding"] = "gzip"
+        return await self._request(method, sd_server, endpoint, bounded, content=body, headers=headers)
+
+    def _should_reference(self, sd_server, digest):
+        """Reference images that were already uploaded or are sent a second time; inline the rest.
+
+        Most images (e.g. video frames) are only sent once, and uploading them
+        would cost an extra round trip and evict images that do repeat.
+        """
+        seen = self._seen.setdefault(sd_server, OrderedDict())
+        if digest in self._uploaded.setdefault(sd_server, set()) or digest in seen:
+            seen.pop(digest, None)
+            return True
+        seen[digest] = True
+        while len(seen) > SEEN_DIGESTS_SIZE:
+            seen.popitem(last=False)
+        return False
+
+    async def _post_json(self, sd_server, endpoint, payload, bounded):
+        self._acquire_server(sd_server)
+        try:
+            return await self._send_json(sd_server, endpoint, payload, bounded)
+        finally:
+            self._release_server(sd_server)
+
+    async def _send_json(self, sd_server, endpoint, payload, bounded):
+        """POST a JSON payload, uploading repeated large images once and referencing them when the server supports it"""
+        get_monitor().check(sd_server, trial=False)
+        features = await self._server_features(sd_server)
+        images = {}
+        if features.get("upload_cache"):
+            payload, images = extract_images(payload, select=lambda digest: self._should_reference(sd_server, digest))
+        body = json.dumps(payload).encode("utf-8")
+        uploaded = self._uploaded.setdefault(sd_server, set())
+
+        for _ in range(2):
+            for digest, data_uri in images.items():
+                if digest not in uploaded:
+                    response = await self._send_body("PUT", sd_server, f"{UPLOAD_CACHE_PATH}/images/{digest}",
+                                                     data_uri.encode("utf-8"), "text/plain", features, bounded=False)
+                    response.raise_for_status()
+                    uploaded.add(digest)
+
+            response = await self._send_body("POST", sd_server, endpoint, body, "application/json", features, bounded)
+            if response.status_code != 409 or not images:
+                return response
+            # The proxy no longer has some of our images (evicted or restarted); upload them again
+            uploaded.difference_update(images)
+        return response
+
+    async def _close_idle_servers(self):
+        """Close the client and forget the state of servers nobody has used for IDLE_TIMEOUT"""
+        now = time.monotonic()
+        idle = [sd_server for sd_server, last_used in self._last_used.items()
+                if not self._in_use.get(sd_server) and now - last_used > IDLE_TIMEOUT]
+        for sd_server in idle:
+            for state in (self._semaphores, self._features, self._uploaded, self._seen, self._in_use, self._last_used):
+                state.pop(sd_server, None)
+            client = self._clients.pop(sd_server, None)
+            if client is not None:
+                await client.aclose()
+
+    async def _reap_sessions(self):
+        while True:
+            await asyncio.sleep(SESSION_REAP_INTERVAL)
+            with self._lock:
+                ended = [session_id for session_id in self._session_futures if not _is_active_session(session_id)]
+            for session_id in ended:
+                self.cancel_session(session_id)
+            await self._close_idle_servers()
+
+    def submit(self, method, sd_server, endpoint, bounded=True, **kwargs):
+        """Start a request and return a concurrent.futures.Future of the httpx response.
+
+        Bounded requests count against the per-server concurrency limit; use
+        bounded=False for light control requests such as progress polling.
+        """
+        return self.run(self._request(method, sd_server, endpoint, bounded, **kwargs))
+
+    def submit_json(self, sd_server, endpoint, payload, bounded=True):
+        """Start a JSON POST request and return a concurrent.futures.Future of the httpx response"""
+        return self.run(self._post_json(sd_server, endpoint, payload, bounded))
+
+    def run(self, coroutine):
+        """Schedule a coroutine on the event loop, cancelling it if the current session ends"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+        session_id = _current_session_id()
+        if session_id is not None:
+            with self._lock:
+                self._session_futures.setdefault(session_id, set()).add(future)
+            future.add_done_callback(lambda done: self._forget(session_id, done))
+        return future
+
+    def _forget(self, session_id, future):
+        with self._lock:
+            futures = self._session_futures.get(session_id)
+            if futures is not None:
+                futures.discard(future)
+                if not futures:
+                    del self._session_futures[session_id]
+
+    def cancel_session(self, session_id):
+        """Cancel all in-flight requests of a session"""
+        with self._lock:
+            futures = list(self._session_futures.pop(session_id, ()))
+        for future in futures:
+            future.cancel()
+
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_transport():
+    """Return the process-wide transport, starting its event loop on first use"""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = AsyncTransport()
+        return _transport
+
+def submit_post(sd_server, endpoint, payload, bounded=True):
+    """Start a POST request with a JSON payload and return a future of the response"""
+    return get_transport().submit_json(sd_server, endpoint, payload, bounded=bounded)
+
+def _wait(future, timeout):
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
+
+def post(sd_server, endpoint, payload=None, bounded=True, timeout=None):
+    """POST a JSON payload and wait for the response"""
+    return _wait(submit_post(sd_server, endpoint, payload, bounded=bounded), timeout)
+
+def get(sd_server, endpoint, params=None, bounded=False, timeout=None):
+    """GET an endpoint and wait for the response"""
+    return _wait(get_transport().submit("GET", sd_server, endpoint, bounded=bounded, params=params), timeout)
@@ -0,0 +1,165 @@
+"""Upload-cache proxy for an Automatic1111 server.
+
+Run it next to the GPU server and point the frontend at the proxy:
+
+    python -m modules.upload_cache_proxy --upstream http://127.0.0.1:7860 --port 7861
+
+The frontend sends a large init/control image inline the first time, uploads
+it once when it is sent again and afterwards only sends an
+"upload-cache:<sha256>" reference, and gzip-compresses large request bodies.
+The proxy resolves references, decompresses bodies and forwards plain
+requests to the server, so the server itself needs no changes.
+"""
+import argparse
+import gzip
+import json
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from modules.payload_cache import UPLOAD_REF_PREFIX, content_digest, resolve_references
+
+UPLOAD_CACHE_PATH = "/upload-cache/v1"
+IMAGE_PATH_PATTERN = re.compile(rf"^{UPLOAD_CACHE_PATH}/images/([0-9a-f]{{64}})$")
+
+# Hop-by-hop and body headers that must not be forwarded as-is
+SKIPPED_HEADERS = {"host", "content-length", "content-encoding", "transfer-encoding", "connection", "keep-alive"}
+
+class ImageStore:
+    """Thread-safe LRU store of uploaded images, bounded by total size"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            data = self._images.get(digest)
+            if data is not None:
+                self._images.move_to_end(digest)
+            return data
+
+    def put(self, digest, data):
+        with self._lock:
+            if digest in self._images:
+                self._images.move_to_end(digest)
+                return
+            self._images[digest] = data
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self.size -= len(evicted)
+
+class UploadCacheProxyHandler(BaseHTTPRequestHandler):
+    """Serve the upload cache endpoints and forward everything else upstream"""
+
+    protocol_version = "HTTP/1.1"
+    upstream = None
+    store = None
+    # requests.Session is not thread-safe, so each handler thread gets its own
+    _local = threading.local()
+
+    @property
+    def session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_json(self, status, data):
+        self._send(status, json.dumps(data).encode("utf-8"))
+
+    def _read_body(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding", "").lower() == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    def _handle(self):
+        try:
+            body = self._read_body()
+        except (OSError, EOFError, zlib.error) as e:
+            self._send_json(400, {"detail": f"Invalid request body: {e}"})
+            return
+
+        path = self.path.split("?", 1)[0]
+        if path == f"{UPLOAD_CACHE_PATH}/ping":
+            self._send_json(200, {"upload_cache": True, "gzip": True})
+            return
+
+        image_match = IMAGE_PATH_PATTERN.match(path)
+        if image_match:
+            self._handle_image(image_match.group(1), body)
+            return
+
+        if UPLOAD_REF_PREFIX.encode("utf-8") in body:
+            try:
+                payload, missing = resolve_references(json.loads(body), lambda digest: self.store.get(digest))
+            except ValueError as e:
+                self._send_json(400, {"detail": f"Invalid JSON body: {e}"})
+                return
+            if missing:
+                self._send_json(409, {"detail": "Unknown upload-cache references", "missing": missing})
+                return
+            body = json.dumps(payload).encode("utf-8")
+
+        self._forward(body)
+
+    def _handle_image(self, digest, body):
+        if self.command == "PUT":
+            try:
+                data = body.decode("utf-8")
+            except UnicodeDecodeError as e:
+                self._send_json(400, {"detail": f"Uploaded image is not a UTF-8 data URI: {e}"})
+                return
+            if content_digest(data) != digest:
+                self._send_json(400, {"detail": "Digest does not match uploaded content"})
+                return
+            self.store.put(digest, data)
+            self._send(204)
+        elif self.command in ("GET", "HEAD"):
+            self._send(200 if self.store.get(digest) is not None else 404)
+        else:
+            self._send_json(405, {"detail": "Method not allowed"})
+
+    def _forward(self, body):
+        headers = {name: value for name, value in self.headers.items() if name.lower() not in SKIPPED_HEADERS}
+        try:
+            response = self.session.request(self.command, f"{self.upstream}{self.path}", data=body or None, headers=headers)
+        except requests.RequestException as e:
+            self._send_json(502, {"detail": f"Upstream error: {e}"})
+            return
+        self._send(response.status_code, response.content, response.headers.get("Content-Type", "application/json"))
+
+    do_GET = do_POST = do_PUT = do_HEAD = do_DELETE = _handle
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload-cache proxy for an Automatic1111 server")
+    parser.add_argument("--upstream", default="http://127.0.0.1:7860", help="Automatic1111 server URL")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=7861, help="Port to listen on")
+    parser.add_argument("--max-cache-mb", type=int, default=512, help="Maximum size of cached images in MB")
+    args = parser.parse_args()
+
+    UploadCacheProxyHandler.upstream = args.upstream.rstrip("/")
+    UploadCacheProxyHandler.store = ImageStore(args.max_cache_mb * 1024 * 1024)
+
+    server = ThreadingHTTPServer((args.host, args.port), UploadCacheProxyHandler)
+    print(f"Upload-cache proxy listening on {args.host}:{args.port}, forwarding to {UploadCacheProxyHandler.upstream}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
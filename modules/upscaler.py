@@ -1,8 +1,11 @@
 import streamlit as st
-import requests
 import base64
 from io import BytesIO
 from PIL import Image
+from modules.payload_cache import encode_image
+from modules import transport
+from modules.gallery import register_image
+from modules.widget_state import persist, persistent_file_uploader
 
 def show_upscaler_tab():
     """Display the Upscaler tab with all its UI elements and functionality"""
@@ -12,7 +15,7 @@ def show_upscaler_tab():
     sd_server = st.session_state.get('sd_server', "http://127.0.0.1:7860")
     
     # Upload image
-    uploaded_image = st.file_uploader("Upload an image to upscale", type=["png", "jpg", "jpeg"], key="upscaler_upload")
+    uploaded_image = persistent_file_uploader("Upload an image to upscale", key="upscaler_upload", type=["png", "jpg", "jpeg"])
     
     if uploaded_image is not None:
         image = Image.open(uploaded_image)
@@ -32,39 +35,42 @@ def show_upscaler_tab():
                 "Lanczos", "Nearest", "ESRGAN_4x", "R-ESRGAN 4x+", "ScuNET GAN"
             ])
             
-            selected_upscaler = st.selectbox("Upscaler", upscalers)
+            selected_upscaler = st.selectbox("Upscaler", upscalers, key=persist("upscaler_model"))
             
         with col2:
-            upscale_factor = st.slider("Upscale Factor", min_value=1.0, max_value=4.0, value=2.0, step=0.5)
+            upscale_factor = st.slider("Upscale Factor", min_value=1.0, max_value=4.0, value=2.0, step=0.5, key=persist("upscaler_factor"))
         
         # Additional options
-        resize_mode = st.radio("Resize Mode", ["Scale from original", "Target resolution"], horizontal=True)
+        resize_mode = st.radio("Resize Mode", ["Scale from original", "Target resolution"], horizontal=True, key=persist("upscaler_resize_mode"))
         
         if resize_mode == "Target resolution":
+            # A kept target smaller than a newly uploaded image would be rejected by the inputs
+            for state_key, size in (("upscaler_target_width", image.width), ("upscaler_target_height", image.height)):
+                if not size <= st.session_state.get(state_key, size) <= 4096:
+                    st.session_state[state_key] = min(size * 2, 4096)
+
             target_col1, target_col2 = st.columns(2)
             with target_col1:
-                target_width = st.number_input("Target Width", min_value=image.width, max_value=4096, value=image.width*2)
+                target_width = st.number_input("Target Width", min_value=image.width, max_value=4096, value=image.width*2, key=persist("upscaler_target_width"))
             with target_col2:
-                target_height = st.number_input("Target Height", min_value=image.height, max_value=4096, value=image.height*2)
+                target_height = st.number_input("Target Height", min_value=image.height, max_value=4096, value=image.height*2, key=persist("upscaler_target_height"))
                 
         # Face restoration option
-        face_restoration = st.checkbox("Restore Faces", value=False)
+        face_restoration = st.checkbox("Restore Faces", value=False, key=persist("upscaler_restore_faces"))
         
         if face_restoration:
             face_restorer = st.selectbox("Face Restoration Model", 
                                        ["CodeFormer", "GFPGAN"], 
-                                       index=0)
+                                       index=0, key=persist("upscaler_face_restorer"))
             if face_restorer == "CodeFormer":
                 codeformer_weight = st.slider("CodeFormer Weight", min_value=0.0, max_value=1.0, value=0.75, step=0.05,
-                                           help="0 = Maximum effect, 1 = Minimum effect")
+                                           help="0 = Maximum effect, 1 = Minimum effect", key=persist("upscaler_codeformer_weight"))
         
         # Upscale button
         if st.button("Upscale Image", key="upscale_button"):
             with st.spinner("Upscaling image... This may take a while depending on image size"):
-                # Convert image to base64
-                buffered = BytesIO()
-                image.save(buffered, format="PNG")
-                img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+                # Convert image to base64 (the encoding is reused while the image is unchanged)
+                img_data_uri = encode_image(image)
                 
                 # Calculate target dimensions
                 if resize_mode == "Scale from original":
@@ -73,7 +79,7 @@ def show_upscaler_tab():
                 
                 # Create payload
                 payload = {
-                    "image": f"data:image/png;base64,{img_base64}",
+                    "image": img_data_uri,
                     "upscaler_1": selected_upscaler,
                     "upscaler_2": "None",
                     "upscaler_2_visibility": 0,
@@ -92,7 +98,7 @@ def show_upscaler_tab():
                 
                 try:
                     # Make API call to the server
-                    response = requests.post(f"{sd_server}/sdapi/v1/extra-single-image", json=payload)
+                    response = transport.post(sd_server, "/sdapi/v1/extra-single-image", payload)
                     
                     if response.status_code == 200:
                         r = response.json()
@@ -100,6 +106,9 @@ def show_upscaler_tab():
                         # Display upscaled image
                         upscaled_image = Image.open(BytesIO(base64.b64decode(r['image'].split(",", 1)[0])))
                         
+                        # Save the upscaled image (repeats of the same upscale are saved once)
+                        register_image(upscaled_image, "upscaler")
+                        
                         # Show comparison
                         st.text(f"Upscaled dimensions: {upscaled_image.width} x {upscaled_image.height} pixels")
                         st.image(upscaled_image, caption="Upscaled Image", use_column_width=True)
@@ -0,0 +1,52 @@
+import streamlit as st
+
+# Streamlit deletes the state of widgets that are not rendered in a run, so the
+# values of a hidden tab would reset on every tab switch. Widgets created with
+# key=persist(...) keep their value while their tab is hidden.
+
+def persist(key):
+    """Register a widget key whose value should survive switching tabs and return it"""
+    st.session_state.setdefault("_persistent_keys", set()).add(key)
+    return key
+
+def keep_widget_state():
+    """Store the values of persistent widgets as plain session state so hidden tabs keep them"""
+    for key in st.session_state.get("_persistent_keys", ()):
+        if key in st.session_state:
+            st.session_state[key] = st.session_state[key]
+
+def _forget_upload(shadow_key, restored_key):
+    st.session_state.pop(shadow_key, None)
+    st.session_state.pop(restored_key, None)
+
+def persistent_file_uploader(label, key, **kwargs):
+    """File uploader that keeps its file while its tab is hidden.
+
+    An uploader cannot be given a value, so the last upload is kept in session
+    state and returned until the user uploads another file or removes it.
+    """
+    shadow_key = f"_{key}_file"
+    restored_key = f"_{key}_restored"
+    recreated = key not in st.session_state
+
+    uploaded_file = st.file_uploader(label, key=key, **kwargs)
+
+    if uploaded_file is not None:
+        st.session_state[shadow_key] = uploaded_file
+        st.session_state.pop(restored_key, None)
+        return uploaded_file
+
+    if recreated and shadow_key in st.session_state:
+        st.session_state[restored_key] = True
+
+    if st.session_state.get(restored_key):
+        uploaded_file = st.session_state[shadow_key]
+        uploaded_file.seek(0)
+        col1, col2 = st.columns([4, 1])
+        col1.caption(f"Using {uploaded_file.name} uploaded earlier")
+        col2.button("Remove", key=f"{key}_remove", on_click=_forget_upload, args=(shadow_key, restored_key))
+        return uploaded_file
+
+    # The user removed the file from the uploader
+    st.session_state.pop(shadow_key, None)
+    return None